@@ -26,8 +26,10 @@ txt = os.path.join(os.path.dirname(os.path.realpath(__file__)),
 meta_data = {'antenna': 'WB', 'freq': 'L', 'band': 'U', 'pol': 'R',
              'exp_code': 'raks00'}
 t0 = Time.now()
-dsp = create_from_txt(txt, 1684., 16. / 128, 0.001, meta_data, t0)
-dsp = dsp.slice(0.0, 0.5)
+dsp_all = create_from_txt(txt, 1684., 16. / 128, 0.001, meta_data, t0)
+# First half is for search, second one - for training classifier. Both are
+# views of the same data.
+dsp = dsp_all.view(stop=dsp_all.n_t // 2)
 print "Start time {}".format(t0)
 # Number of artificially injected pulses
 n_pulses = 3
@@ -107,9 +109,7 @@ pclf = PulseClassifier(noncoherent_dedisperse, create_ellipses,
                                           'threshold_big_perc': 99.5,
                                           'threshold_perc': 93.5,
                                           'statistic': 'mean'})
-dsp_training = create_from_txt(txt, 1684., 16. / 128, 0.001, meta_data,
-                               t_0=Time.now())
-dsp_training = dsp_training.slice(0.5, 1.0)
+dsp_training = dsp_all.view(start=dsp_all.n_t // 2)
 
 # Generate values of pulses in training sample
 print "Creating training sample"
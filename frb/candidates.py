@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 import os
 from sqlalchemy import (Column, Integer, Float, String, ForeignKey, DateTime)
-from sqlalchemy import create_engine
+from sqlalchemy import (create_engine, inspect)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import (backref, relation, sessionmaker)
 
@@ -60,26 +60,65 @@ class Candidate(Base):
     id = Column(Integer, primary_key=True)
     t = Column(DateTime)
     dm = Column(Float)
+    width = Column(Float)
+    snr = Column(Float)
     searched_data_id = Column(Integer, ForeignKey('searched_data.id'))
 
     candidate = relation(SearchedData, backref=backref('candidates',
                                                        order_by=id))
 
-    def __init__(self, t, dm):
+    def __init__(self, t, dm, width=None, snr=None):
         """
         :param t:
             Instance of ``astropy.time.Time``.
         :param dm:
             Dispersion measure of pulse.
+        :param width: (optional)
+            Width of pulse [s]. (default: ``None``)
+        :param snr: (optional)
+            Signal-to-noise ratio of pulse. (default: ``None``)
         """
         self.t = t.utc.datetime
         self.dm = dm
+        self.width = width
+        self.snr = snr
 
     def __repr__(self):
         # return "FRB candidate. t0: {}, DM: {}".format(self.t, self.dm)
-        return "FRB candidate. t0: " \
-               "{:%Y-%m-%d %H:%M:%S.%f}".format(self.t)[:-3] +\
-               " DM: {:.0f}".format(self.dm)
+        result = "FRB candidate. t0: " \
+                 "{:%Y-%m-%d %H:%M:%S.%f}".format(self.t)[:-3] +\
+                 " DM: {:.0f}".format(self.dm)
+        # Width and SNR are unknown for some searches and for old DB rows
+        fields = list()
+        if self.width is not None:
+            fields.append("width: {:.4f}".format(self.width))
+        if self.snr is not None:
+            fields.append("SNR: {:.1f}".format(self.snr))
+        if fields:
+            result += " " + ", ".join(fields)
+        return result
+
+
+def upgrade_db(engine):
+    """
+    Create absent tables and add columns that were introduced after DB was
+    created (e.g. ``width`` and ``snr`` of ``Candidate``). Existing rows get
+    ``NULL`` values in new columns.
+
+    :param engine:
+        Instance of ``sqlalchemy.engine.Engine``.
+    """
+    Base.metadata.create_all(engine, checkfirst=True)
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        columns = [column['name'] for column in
+                   inspector.get_columns(table.name)]
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            engine.execute("ALTER TABLE {} ADD COLUMN {} {}".format(
+                table.name, column.name,
+                column.type.compile(dialect=engine.dialect)))
 
 
 # create a connection to a sqlite database
@@ -87,8 +126,8 @@ db_file = os.path.join(os.path.dirname(os.path.realpath(__file__)),
                        'frb.db')
 engine = create_engine("sqlite:///{}".format(db_file))
 
-# This creates tables
-Base.metadata.create_all(engine, checkfirst=True)
+# This creates tables and upgrades ones of DB created by older versions
+upgrade_db(engine)
 
 Session = sessionmaker(bind=engine)
 session = Session()
@@ -1,9 +1,782 @@
 # -*- coding: utf-8 -*-
+import atexit
+import ctypes
+import multiprocessing
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from storage import is_in_memory, read_into
 
 # MHz ** 2 * cm ** 3 * s / pc
 k = 1. / (2.410331 * 10 ** (-4))
 
 
+def channel_smearing(nu, d_nu, dm):
+    """
+    Dispersion smearing of pulse inside frequency channel.
+
+    :param nu:
+        Frequency of channel [MHz].
+    :param d_nu:
+        Width of channel [MHz].
+    :param dm:
+        Dispersion measure [cm^3 / pc].
+
+    :return:
+        Smearing time [s].
+    """
+    return 2. * k * dm * d_nu / nu ** 3.
+
+
+class DedispersionPlan(object):
+    """
+    Class that holds time shifts of frequency channels for grid of DM values
+    and de-disperses any dynamical spectra with the same geometry.
+
+    :param nu:
+        Array-like of frequencies of channels [MHz] in order of rows of
+        dynamical spectra.
+    :param d_t:
+        Time step [s].
+    :param dm_grid:
+        Array-like of value of DM [cm^3/pc].
+
+    :note:
+        Plan is built once and could be used for all chunks of data with the
+        same frequency channels and time step (see ``get_plan``).
+    """
+    def __init__(self, nu, d_t, dm_grid):
+        self.nu = np.asarray(nu, dtype=float)
+        self.d_t = float(d_t)
+        self.dm_grid = np.atleast_1d(np.asarray(dm_grid, dtype=float))
+        self.nu_0 = self.nu.max()
+        # Time shifts [s] of all channels relative to the highest frequency
+        # channel for all values of DM (#DM, #nu)
+        self.delays = k * self.dm_grid[:, np.newaxis] * (1. / self.nu ** 2. -
+                                                         1. / self.nu_0 ** 2.)
+        # Corresponding number of time steps
+        self.shifts = np.rint(self.delays / self.d_t).astype(int)
+        self.max_shift = int(self.shifts.max())
+        self._segments = None
+
+    def __repr__(self):
+        return "DedispersionPlan(n_nu={}, nu_0={}, nu_min={}, d_t={}," \
+               " dm_grid={})".format(len(self.nu), self.nu_0, self.nu.min(),
+                                     self.d_t, self.dm_grid.__repr__())
+
+    @classmethod
+    def from_dsp(cls, dsp, dm_grid):
+        """
+        Create plan for geometry of ``DynSpectra`` instance.
+        """
+        return cls(dsp.nu, dsp.d_t.sec, dm_grid)
+
+    def matches(self, dsp):
+        """
+        Check if plan could be used for ``DynSpectra`` instance.
+        """
+        return (len(dsp.nu) == len(self.nu) and np.allclose(dsp.nu, self.nu)
+                and np.isclose(dsp.d_t.sec, self.d_t))
+
+    def dedisperse(self, values, wrap=True, out=None, weights=None,
+                   sample_weights=None):
+        """
+        De-disperse dynamical spectra and sum them in frequency.
+
+        :param values:
+            2D numpy array (#nu, #t) of dynamical spectra.
+        :param wrap: (optional)
+            Boolean. If ``True`` then shifted channels are wrapped in time (as
+            ``np.roll`` does) and ``#t`` time steps are returned. If ``False``
+            then only ``#t - max_shift`` time steps that are not affected by
+            wrapping are returned and DM values must be non-negative.
+            (default: ``True``)
+        :param out: (optional)
+            Array to put result in. If ``None`` then create new one. (default:
+            ``None``)
+        :param weights: (optional)
+            Array-like of weights of channels. Channels with zero weight are
+            skipped. If ``None`` then all weights are ones. (default:
+            ``None``)
+        :param sample_weights: (optional)
+            2D numpy array (#nu, #t) of weights of samples. If ``None`` then
+            all weights are ones. (default: ``None``)
+
+        :return:
+            2D numpy array (a.k.a. TDM-array) (#DM, #t) of weighted sums over
+            frequency.
+        """
+        n_nu, n_t = values.shape
+        weights, channels = _check_weights(weights)
+        if wrap:
+            # Weights are applied while copying data to extended array
+            extended, shifts = self._extend(values, weights, sample_weights)
+            weights = None
+            n_out = n_t
+        else:
+            _check_dm_grid(self.dm_grid)
+            shifts = self.shifts
+            if self.max_shift >= n_t:
+                raise Exception("Maximum time shift {} exceeds number of time"
+                                " steps {}".format(self.max_shift, n_t))
+            # Weights of channels are applied by ``_shift_and_sum``
+            extended = _fold_weights(values, sample_weights=sample_weights)
+            n_out = n_t - self.max_shift
+        if out is None:
+            out = np.empty((len(self.dm_grid), n_out), dtype=float)
+        _shift_and_sum(extended, shifts, n_out, out, channels=channels,
+                       weights=_kernel_weights(weights))
+        return out
+
+    def _extend(self, values, weights, sample_weights):
+        """
+        Copy weighted dynamical spectra to array extended by wrapped time
+        steps.
+
+        :return:
+            Extended array and shifts wrapped to number of time steps.
+        """
+        n_nu, n_t = values.shape
+        shifts = self.shifts % n_t
+        max_shift = int(shifts.max())
+        # Weights are applied while copying data to extended array
+        extended = np.empty((n_nu, n_t + max_shift), dtype=values.dtype)
+        _fold_weights(values, weights, sample_weights, out=extended[:, :n_t])
+        extended[:, n_t:] = extended[:, :max_shift]
+        return extended, shifts
+
+    def dedisperse_to(self, values, out, weights=None, sample_weights=None,
+                      scale=1., n_dm_block=None):
+        """
+        De-disperse dynamical spectra and write sums over frequency to
+        out-of-core array one block of DM values at a time. Time shifts are
+        wrapped as ``np.roll`` does.
+
+        :param values:
+            2D numpy array (#nu, #t) of dynamical spectra.
+        :param out:
+            Array-like (#DM, #t) that supports assignment of slices of rows,
+            e.g. ``numpy.memmap`` or ``h5py.Dataset``. Resizable HDF5 dataset
+            is resized if its shape differs.
+        :param weights: (optional)
+            Array-like of weights of channels. (default: ``None``)
+        :param sample_weights: (optional)
+            2D numpy array (#nu, #t) of weights of samples. (default:
+            ``None``)
+        :param scale: (optional)
+            Factor to multiply sums by (e.g. to average over channels).
+            (default: ``1.``)
+        :param n_dm_block: (optional)
+            Number of values of DM in block. If ``None`` then keep block
+            within ``2 ** 24`` values. (default: ``None``)
+
+        :return:
+            ``out``.
+        """
+        n_nu, n_t = values.shape
+        n_dm = len(self.dm_grid)
+        if tuple(out.shape) != (n_dm, n_t):
+            out.resize((n_dm, n_t))
+        weights, channels = _check_weights(weights)
+        extended, shifts = self._extend(values, weights, sample_weights)
+        if n_dm_block is None:
+            n_dm_block = max(1, 2 ** 24 // n_t)
+        block = np.empty((min(n_dm_block, n_dm), n_t), dtype=float)
+        for start in range(0, n_dm, n_dm_block):
+            stop = min(start + n_dm_block, n_dm)
+            block_ = block[:stop - start]
+            _shift_and_sum(extended, shifts[start: stop], n_t, block_,
+                           channels=channels)
+            block_ *= scale
+            out[start: stop] = block_
+        if hasattr(out, 'flush'):
+            out.flush()
+        return out
+
+    @property
+    def segments(self):
+        """
+        Tables of segments of neighbouring channels with equal time shifts
+        for all values of DM.
+
+        :return:
+            List (one item for each value of DM) of tuples with array of
+            indexes of the last channels of segments (except the last one),
+            arrays of shifts of these segments and of segments that follow
+            them and shift of the last segment.
+        """
+        if self._segments is None:
+            self._segments = list()
+            for shifts in self.shifts:
+                ends = np.flatnonzero(shifts[1:] != shifts[:-1])
+                self._segments.append((ends, shifts[ends], shifts[ends + 1],
+                                       shifts[-1]))
+        return self._segments
+
+    def dedisperse_cumsum(self, values, weights=None, sample_weights=None,
+                          out=None):
+        """
+        De-disperse dynamical spectra using cumulative sums over channels and
+        sum them in frequency.
+
+        Sum of each segment of neighbouring channels with equal time shift is
+        difference of two cumulative sums, so each value of DM costs two
+        rolled additions per segment (see ``segments``) instead of one per
+        channel. Any pattern of shifts is supported.
+
+        :param values:
+            2D numpy array (#nu, #t) of dynamical spectra.
+        :param weights: (optional)
+            Array-like of weights of channels. (default: ``None``)
+        :param sample_weights: (optional)
+            2D numpy array (#nu, #t) of weights of samples. (default:
+            ``None``)
+        :param out: (optional)
+            Array to put result in. If ``None`` then create new one. (default:
+            ``None``)
+
+        :return:
+            2D numpy array (a.k.a. TDM-array) (#DM, #t) of weighted sums over
+            frequency. Time shifts are wrapped as ``np.roll`` does.
+
+        :note:
+            The only working buffer is ``float32`` array (#nu, #t) of
+            cumulative sums.
+        """
+        n_nu, n_t = values.shape
+        weights, _ = _check_weights(weights)
+        cumsums = np.empty((n_nu, n_t), dtype=np.float32)
+        _fold_weights(values, weights, sample_weights, out=cumsums)
+        np.cumsum(cumsums, axis=0, out=cumsums)
+        if out is None:
+            out = np.empty((len(self.dm_grid), n_t), dtype=float)
+        out[:] = 0.
+        for row, (ends, shifts, next_shifts, last_shift) in zip(out,
+                                                               self.segments):
+            _add_rolled(row, cumsums[-1], last_shift)
+            for end, shift, next_shift in zip(ends, shifts, next_shifts):
+                _add_rolled(row, cumsums[end], shift)
+                _add_rolled(row, cumsums[end], next_shift, subtract=True)
+        return out
+
+
+def _check_dm_grid(dm_grid):
+    """
+    Check that DM values are non-negative. Engines that don't wrap shifted
+    channels in time only support non-negative time shifts.
+    """
+    dm_grid = np.asarray(dm_grid, dtype=float)
+    if np.any(dm_grid < 0):
+        raise ValueError("Negative DM values are not supported without"
+                         " wrapping, got minimal DM {}".format(dm_grid.min()))
+    return dm_grid
+
+
+def _check_weights(weights):
+    """
+    Check weights of channels.
+
+    :return:
+        Numpy array of weights (or ``None`` if all weights are ones) and array
+        of indexes of channels with non-zero weights (or ``None`` if there are
+        no such channels).
+    """
+    if weights is None:
+        return None, None
+    weights = np.asarray(weights)
+    if np.all(weights == 1):
+        return None, None
+    channels = np.flatnonzero(weights)
+    if len(channels) == len(weights):
+        channels = None
+    return weights, channels
+
+
+def _kernel_weights(weights):
+    """
+    Weights of channels that have to be applied while summing channels.
+
+    :return:
+        ``None`` if all weights are zeros or ones (channels with zero weight
+        are just skipped), otherwise numpy array of weights.
+    """
+    if weights is None or np.all((weights == 0) | (weights == 1)):
+        return None
+    return weights
+
+
+def _fold_weights(values, weights=None, sample_weights=None, out=None):
+    """
+    Multiply dynamical spectra by weights of channels and samples.
+
+    :param values:
+        2D numpy array (#nu, #t) of dynamical spectra or other array-like
+        storage (e.g. ``h5py.Dataset``, see ``storage``).
+    :param weights: (optional)
+        Array-like of weights of channels. (default: ``None``)
+    :param sample_weights: (optional)
+        2D numpy array (#nu, #t) of weights of samples. (default: ``None``)
+    :param out: (optional)
+        Array to put result in. If ``None`` and there are no weights then
+        ``values`` itself is returned (if it is numpy array), otherwise new
+        array is created. (default: ``None``)
+    """
+    if out is None:
+        if (weights is None and sample_weights is None and
+                is_in_memory(values)):
+            return values
+        out = np.empty(values.shape, dtype=np.result_type(values.dtype,
+                                                          np.float32))
+    read_into(values, out)
+    if sample_weights is not None:
+        out *= sample_weights
+    if weights is not None:
+        out *= np.asarray(weights, dtype=out.dtype)[..., np.newaxis]
+    return out
+
+
+# Number of time steps processed at once by ``_shift_and_sum``
+_block_size = 2 ** 14
+
+
+def _shift_and_sum(extended, shifts, n_out, out, channels=None,
+                   weights=None):
+    """
+    Sum frequency channels shifted in time.
+
+    :param extended:
+        2D numpy array (#nu, #t) with at least ``n_out + shifts.max()`` time
+        steps.
+    :param shifts:
+        2D numpy array (#DM, #nu) of non-negative time shifts.
+    :param n_out:
+        Number of time steps to calculate.
+    :param out:
+        Array (#DM, n_out) to put result in.
+    :param channels: (optional)
+        Array-like of indexes of channels to sum. If ``None`` then sum all
+        channels. (default: ``None``)
+    :param weights: (optional)
+        Array-like of weights of all channels. Gathered channels are
+        multiplied by them while summing, so ``extended`` is never weighted
+        as a whole. If ``None`` then all weights are ones. (default:
+        ``None``)
+    """
+    n_nu = extended.shape[0]
+    max_shift = int(shifts.max())
+    if channels is None:
+        channels = np.arange(n_nu)
+    else:
+        shifts = shifts[:, channels]
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)[channels]
+    # Blocks of time steps keep gathered channels in cache
+    for t_start in range(0, n_out, _block_size):
+        n_block = min(_block_size, n_out - t_start)
+        # All time windows of each channel as a view (#nu, #shifts, #t)
+        windows = as_strided(extended[:, t_start:],
+                             shape=(n_nu, max_shift + 1, n_block),
+                             strides=(extended.strides[0],
+                                      extended.strides[1],
+                                      extended.strides[1]))
+        for i, shifts_ in enumerate(shifts):
+            if weights is None:
+                np.sum(windows[channels, shifts_], axis=0, dtype=float,
+                       out=out[i, t_start: t_start + n_block])
+            else:
+                out[i, t_start: t_start + n_block] =\
+                    np.dot(weights, windows[channels, shifts_])
+
+
+# Shared buffers that worker processes of ``DedispersionPool`` inherit
+_worker_buffers = dict()
+
+
+def _init_worker(values_buffer, tdm_buffer):
+    _worker_buffers['values'] = values_buffer
+    _worker_buffers['tdm'] = tdm_buffer
+
+
+def _dedisperse_tile(args):
+    """
+    De-disperse block of DM values and time steps in worker process.
+    """
+    (n_nu, n_ext, n_dm, n_t), (dm_start, dm_stop), (t_start, t_stop),\
+        shifts, channels = args
+    extended = np.ctypeslib.as_array(_worker_buffers['values'])
+    extended = extended[:n_nu * n_ext].reshape((n_nu, n_ext))
+    tdm = np.ctypeslib.as_array(_worker_buffers['tdm'])
+    tdm = tdm[:n_dm * n_t].reshape((n_dm, n_t))
+    _shift_and_sum(extended[:, t_start:], shifts, t_stop - t_start,
+                   tdm[dm_start: dm_stop, t_start: t_stop], channels=channels)
+
+
+class DedispersionPool(object):
+    """
+    Long-lived pool of worker processes that de-disperse dynamical spectra.
+
+    Worker processes are started once and inherit shared memory buffers for
+    input dynamical spectra and output TDM-array. Each call copies data to
+    input buffer once, workers calculate blocks of DM values (or time steps,
+    if there are few DM values) and write them directly to output buffer. So
+    neither data nor ``DynSpectra`` instances are pickled.
+
+    :param threads:
+        Number of worker processes.
+
+    :note:
+        Buffers grow (and workers are restarted) only when data with larger
+        size comes. Use ``get_pool`` to share pools between calls.
+    """
+    def __init__(self, threads):
+        self.threads = threads
+        self._pool = None
+        self._values_buffer = None
+        self._tdm_buffer = None
+
+    def _start(self, values_size, tdm_size):
+        self.close()
+        self._values_buffer = multiprocessing.RawArray(ctypes.c_float,
+                                                       values_size)
+        self._tdm_buffer = multiprocessing.RawArray(ctypes.c_double,
+                                                    tdm_size)
+        self._pool = multiprocessing.Pool(self.threads,
+                                          initializer=_init_worker,
+                                          initargs=(self._values_buffer,
+                                                    self._tdm_buffer))
+
+    def close(self):
+        """
+        Stop worker processes and release buffers.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+        self._pool = None
+        self._values_buffer = None
+        self._tdm_buffer = None
+
+    def dedisperse(self, values, plan, out=None, weights=None,
+                   sample_weights=None):
+        """
+        De-disperse dynamical spectra and sum them in frequency.
+
+        :param values:
+            2D numpy array (#nu, #t) of dynamical spectra.
+        :param plan:
+            Instance of ``DedispersionPlan`` for geometry of ``values``.
+        :param out: (optional)
+            Array to put result in. If ``None`` then create new one. (default:
+            ``None``)
+        :param weights: (optional)
+            Array-like of weights of channels. (default: ``None``)
+        :param sample_weights: (optional)
+            2D numpy array (#nu, #t) of weights of samples. (default:
+            ``None``)
+
+        :return:
+            2D numpy array (a.k.a. TDM-array) (#DM, #t) of weighted sums over
+            frequency. Time shifts are wrapped as ``np.roll`` does.
+        """
+        n_nu, n_t = values.shape
+        weights, channels = _check_weights(weights)
+        n_dm = len(plan.dm_grid)
+        shifts = plan.shifts % n_t
+        n_ext = n_t + int(shifts.max())
+        if (self._pool is None or
+                len(self._values_buffer) < n_nu * n_ext or
+                len(self._tdm_buffer) < n_dm * n_t):
+            self._start(n_nu * n_ext, n_dm * n_t)
+
+        extended = np.ctypeslib.as_array(self._values_buffer)
+        extended = extended[:n_nu * n_ext].reshape((n_nu, n_ext))
+        _fold_weights(values, weights, sample_weights, out=extended[:, :n_t])
+        extended[:, n_t:] = extended[:, :n_ext - n_t]
+
+        dm_blocks = np.array_split(np.arange(n_dm),
+                                   min(n_dm, 2 * self.threads))
+        t_blocks = np.array_split(np.arange(n_t),
+                                  max(1, 2 * self.threads // len(dm_blocks)))
+        tasks = list()
+        for dm_block in dm_blocks:
+            for t_block in t_blocks:
+                tasks.append(((n_nu, n_ext, n_dm, n_t),
+                              (dm_block[0], dm_block[-1] + 1),
+                              (t_block[0], t_block[-1] + 1),
+                              shifts[dm_block], channels))
+        self._pool.map(_dedisperse_tile, tasks)
+
+        tdm = np.ctypeslib.as_array(self._tdm_buffer)
+        tdm = tdm[:n_dm * n_t].reshape((n_dm, n_t))
+        if out is None:
+            return tdm.copy()
+        out[:] = tdm
+        return out
+
+
+# Pools that are shared between calls
+_pools = dict()
+
+
+def get_pool(threads):
+    """
+    Get long-lived ``DedispersionPool`` instance with given number of worker
+    processes.
+    """
+    if threads not in _pools:
+        _pools[threads] = DedispersionPool(threads)
+    return _pools[threads]
+
+
+@atexit.register
+def _close_pools():
+    for pool in _pools.values():
+        pool.close()
+
+
+class StreamingDedisperser(object):
+    """
+    Class that de-disperses long recording coming in consecutive chunks
+    without wrapping shifted channels in time.
+
+    Last ``max_shift`` time steps of each chunk are kept and prepended to the
+    next chunk, so pulses that straddle chunk boundaries are de-dispersed as
+    in continuous data and memory stays constant.
+
+    :param plan:
+        Instance of ``DedispersionPlan`` for geometry of chunks. DM values
+        must be non-negative.
+    """
+    def __init__(self, plan):
+        _check_dm_grid(plan.dm_grid)
+        self.plan = plan
+        self._tail = None
+        # Number of TDM time steps that were already returned
+        self.n_processed = 0
+
+    def process(self, values, weights=None, sample_weights=None):
+        """
+        De-disperse next chunk and sum it in frequency.
+
+        :param values:
+            2D numpy array (#nu, #t) of next chunk of dynamical spectra.
+        :param weights: (optional)
+            Array-like of weights of channels. (default: ``None``)
+        :param sample_weights: (optional)
+            2D numpy array (#nu, #t) of weights of samples of chunk. (default:
+            ``None``)
+
+        :return:
+            2D numpy array (a.k.a. TDM-array) (#DM, #t') of sums over
+            frequency for time steps that became complete. The first column
+            corresponds to time step ``n_processed`` (before call) of
+            recording.
+        """
+        weights, channels = _check_weights(weights)
+        # Weights of channels are applied by ``_shift_and_sum``
+        values = _fold_weights(values, sample_weights=sample_weights)
+        if self._tail is not None:
+            values = np.concatenate((self._tail, values), axis=1)
+        n_t = values.shape[1]
+        max_shift = self.plan.max_shift
+        if n_t <= max_shift:
+            self._tail = np.array(values)
+            return np.empty((len(self.plan.dm_grid), 0), dtype=float)
+        tdm = np.empty((len(self.plan.dm_grid), n_t - max_shift))
+        _shift_and_sum(values, self.plan.shifts, n_t - max_shift, tdm,
+                       channels=channels, weights=_kernel_weights(weights))
+        self._tail = np.array(values[:, n_t - max_shift:])
+        self.n_processed += tdm.shape[1]
+        return tdm
+
+
+class IncrementalDedisperser(object):
+    """
+    Class that extends TDM-array of growing dynamical spectra (see
+    ``DynSpectra.append``) by new time steps only.
+
+    Partial sums of the last ``max_shift`` time steps of TDM-array (that
+    still wait for data in lower frequency channels) are kept between
+    updates, so cost of update is proportional to number of new time steps
+    (plus ``max_shift``) and doesn't depend on length of data.
+
+    :param plan:
+        Instance of ``DedispersionPlan`` for geometry of dynamical spectra.
+        DM values must be non-negative.
+    """
+    def __init__(self, plan):
+        _check_dm_grid(plan.dm_grid)
+        self.plan = plan
+        n_dm = len(plan.dm_grid)
+        # Partial sums for last ``max_shift`` time steps of data consumed
+        self._partial = np.zeros((n_dm, plan.max_shift))
+        # Array that holds TDM-array and has room for new time steps
+        self._tdm = np.empty((n_dm, 0))
+        # Number of time steps of data consumed
+        self.n_consumed = 0
+
+    @property
+    def n_complete(self):
+        """
+        Number of time steps of TDM-array that are complete.
+        """
+        return max(0, self.n_consumed - self.plan.max_shift)
+
+    @property
+    def tdm(self):
+        """
+        2D numpy array (a.k.a. TDM-array) (#DM, #t) of sums over frequency
+        for all complete time steps (without wrapping).
+        """
+        return self._tdm[:, :self.n_complete]
+
+    def update(self, dsp):
+        """
+        Consume time steps of dynamical spectra that were appended since last
+        update.
+
+        :param dsp:
+            Instance of ``DynSpectra`` class.
+
+        :return:
+            2D numpy array (#DM, #t) with time steps of TDM-array that became
+            complete.
+        """
+        values = dsp.values[:, self.n_consumed:]
+        sample_weights = dsp.sample_weights
+        if sample_weights is not None:
+            sample_weights = sample_weights[:, self.n_consumed:]
+        weights, channels = _check_weights(dsp.weights)
+        n_nu, n_new = values.shape
+        max_shift = self.plan.max_shift
+        n_complete = self.n_complete
+
+        # New data with zeros on both sides, so that each time step of result
+        # gets only contributions of new time steps. Result covers
+        # ``max_shift`` time steps before new data and new data itself.
+        padded = np.zeros((n_nu, n_new + 2 * max_shift), dtype=values.dtype)
+        _fold_weights(values, weights, sample_weights,
+                      out=padded[:, max_shift: max_shift + n_new])
+        result = np.empty((len(self.plan.dm_grid), n_new + max_shift))
+        _shift_and_sum(padded, self.plan.shifts, n_new + max_shift, result,
+                       channels=channels)
+        result[:, :max_shift] += self._partial
+        self._partial = result[:, n_new:].copy()
+        self.n_consumed += n_new
+
+        # Skip time steps before the start of data
+        result = result[:, max(0, max_shift - self.n_consumed + n_new):n_new]
+        if self.n_complete > self._tdm.shape[1]:
+            tdm = np.empty((len(self.plan.dm_grid),
+                            max(self.n_complete, 2 * self._tdm.shape[1])))
+            tdm[:, :n_complete] = self._tdm[:, :n_complete]
+            self._tdm = tdm
+        self._tdm[:, n_complete: self.n_complete] = result
+        return result
+
+
+def stream_dedisperse(dsps, dm_grid):
+    """
+    Generator that de-disperses consecutive chunks of long recording and
+    averages them in frequency.
+
+    :param dsps:
+        Iterable of consecutive ``DynSpectra`` instances with the same geometry
+        (eg. ``SearchExperiment.dsp_generator``).
+    :param dm_grid:
+        Array-like of non-negative value of DM on which to de-disperse
+        [cm^3/pc].
+
+    :return:
+        Tuples of start time (instance of ``astropy.time.Time``) and 2D numpy
+        array (a.k.a. TDM-array) (#DM, #t) of de-dispersed data without
+        wrapped samples. Time steps of consecutive arrays follow each other.
+    """
+    streamer = None
+    t_0 = None
+    for dsp in dsps:
+        if streamer is None:
+            streamer = StreamingDedisperser(get_plan(dsp.nu, dsp.d_t.sec,
+                                                     dm_grid))
+            t_0 = dsp.t_0
+        n_processed = streamer.n_processed
+        tdm = streamer.process(dsp.values, weights=dsp.weights,
+                               sample_weights=dsp.sample_weights)
+        if tdm.shape[1]:
+            yield t_0 + n_processed * dsp.d_t, tdm / dsp.n_nu_eff
+
+
+# Plans for recently used geometries
+_plans = dict()
+
+
+def get_plan(nu, d_t, dm_grid):
+    """
+    Get ``DedispersionPlan`` instance for given geometry. Plans are cached, so
+    consecutive chunks of data with the same geometry share one plan.
+
+    :param nu:
+        Array-like of frequencies of channels [MHz].
+    :param d_t:
+        Time step [s].
+    :param dm_grid:
+        Array-like of value of DM [cm^3/pc].
+
+    :return:
+        Instance of ``DedispersionPlan`` class.
+    """
+    nu = np.asarray(nu, dtype=float)
+    dm_grid = np.atleast_1d(np.asarray(dm_grid, dtype=float))
+    key = (nu.tostring(), float(d_t), dm_grid.tostring())
+    if key not in _plans:
+        if len(_plans) > 16:
+            _plans.clear()
+        _plans[key] = DedispersionPlan(nu, d_t, dm_grid)
+    return _plans[key]
+
+
+def batch_dedisperse(dsps, dm_grid):
+    """
+    De-disperse stack of dynamical spectra with the same geometry (e.g. the
+    same time range observed by several antennas) and average them in
+    frequency.
+
+    :param dsps:
+        Sequence of ``DynSpectra`` instances with the same frequency channels,
+        time step and number of time steps.
+    :param dm_grid:
+        Array-like of value of DM on which to de-disperse [cm^3/pc].
+
+    :return:
+        3D numpy array (#dsp, #DM, #t) - stack of TDM-arrays.
+
+    :note:
+        All instances share one ``DedispersionPlan`` with its table of
+        wrapped shifts and one ``float32`` buffer with extended data. Shifted
+        channels of each instance are summed directly into its slice of the
+        stack, so no TDM-array is allocated or copied besides the stack
+        itself.
+    """
+    dsp_0 = dsps[0]
+    n_nu, n_t = dsp_0.values.shape
+    plan = get_plan(dsp_0.nu, dsp_0.d_t.sec, dm_grid)
+    for dsp in dsps[1:]:
+        if not plan.matches(dsp) or dsp.n_t != n_t:
+            raise Exception("Dynamical spectra must have the same geometry")
+
+    shifts = plan.shifts % n_t
+    max_shift = int(shifts.max())
+    extended = np.empty((n_nu, n_t + max_shift), dtype=np.float32)
+    tdm = np.empty((len(dsps), len(plan.dm_grid), n_t), dtype=float)
+    for i, dsp in enumerate(dsps):
+        weights, channels = _check_weights(dsp.weights)
+        _fold_weights(dsp.values, weights, dsp.sample_weights,
+                      out=extended[:, :n_t])
+        extended[:, n_t:] = extended[:, :max_shift]
+        _shift_and_sum(extended, shifts, n_t, tdm[i], channels=channels)
+        tdm[i] /= dsp.n_nu_eff
+    return tdm
+
+
 def de_disperse_cumsum(dsp, dm_values):
     """
     De-disperse dynamical spectra with grid of user specifies values of DM.
@@ -17,13 +790,15 @@ def de_disperse_cumsum(dsp, dm_values):
         2D numpy array (a.k.a. TDM-array) (#DM, #t)
 
     :notes:
-        Probably, it won't work (at least efficiently) when time shift between
-        close frequency channels > one time interval.
+        It is efficient when many neighbouring channels share the same time
+        shift (low DM). At high DM each channel is a separate segment and it
+        costs about twice more than ``noncoherent_dedisperse``.
     """
     return dsp.de_disperse_cumsum(dm_values)
 
 
-def noncoherent_dedisperse(dsp, dm_grid, threads=1):
+def noncoherent_dedisperse(dsp, dm_grid, threads=1, n_subbands=None,
+                           decimate=False, out=None):
     """
     Method that de-disperse dynamical spectra with range values of dispersion
     measures and average them in frequency to obtain image in (t, DM)-plane.
@@ -35,6 +810,648 @@ def noncoherent_dedisperse(dsp, dm_grid, threads=1):
     :param threads: (optional)
         Number of threads used for parallelization with ``multiprocessing``
         module. If ``1`` then it isn't used. (default: 1)
+    :param n_subbands: (optional)
+        Number of sub-bands for two-stage de-dispersion. If ``None`` then each
+        value of DM is de-dispersed directly. Extra smearing introduced by
+        sub-bands could be found with ``subband_smearing``. (default:
+        ``None``)
+    :param decimate: (optional)
+        Boolean. Decimate time axis for values of DM where smearing inside
+        channel exceeds sampling time (see ``decimation_factors``). Then
+        instance of ``MultiResolutionTDM`` is returned. (default: ``False``)
+    :param out: (optional)
+        Out-of-core array (#DM, #t) (e.g. ``numpy.memmap`` or ``h5py.Dataset``)
+        to write result in block by block in one process. It can't be used
+        with ``threads > 1``, ``n_subbands`` or ``decimate``. If ``None`` then
+        return numpy array. (default: ``None``)
     """
+    if out is not None:
+        if threads > 1 or n_subbands is not None or decimate:
+            raise ValueError("Out-of-core output can't be used with threads,"
+                             " sub-bands or time decimation")
+        return dsp.grid_dedisperse(dm_grid, out=out)
+    if decimate:
+        if n_subbands is not None:
+            raise Exception("Sub-band de-dispersion can't be used with time"
+                            " decimation")
+        return _decimated_dedisperse(dsp, dm_grid, threads=threads)
+    if n_subbands is not None:
+        return _subband_dedisperse(dsp, dm_grid, n_subbands, threads=threads)
     return dsp.grid_dedisperse(dm_grid, threads=threads)
 
+
+def decimation_factors(nu, d_nu, d_t, dm_grid, max_factor=None):
+    """
+    Factors of time decimation for values of DM. Factor is the largest power
+    of two that doesn't exceed number of time steps covered by smearing of
+    pulse inside the lowest frequency channel.
+
+    :param nu:
+        Array-like of frequencies of channels [MHz].
+    :param d_nu:
+        Width of channel [MHz].
+    :param d_t:
+        Time step [s].
+    :param dm_grid:
+        Array-like of value of DM [cm^3/pc].
+    :param max_factor: (optional)
+        Maximum factor of decimation. If ``None`` then don't limit. (default:
+        ``None``)
+
+    :return:
+        Numpy array of integer factors for each value of ``dm_grid``.
+    """
+    dm_grid = np.asarray(dm_grid, dtype=float)
+    smearing = channel_smearing(np.min(nu), d_nu, abs(dm_grid)) / d_t
+    factors = 2 ** np.floor(np.log2(np.maximum(smearing, 1.)))
+    if max_factor is not None:
+        factors = np.minimum(factors, max_factor)
+    return factors.astype(int)
+
+
+class MultiResolutionTDM(object):
+    """
+    Image of (t, DM)-plane where rows with different values of DM have
+    different time resolution. Each block of rows is stored with its own time
+    step ``factor * d_t``.
+
+    Instances could be passed wherever 2D numpy.ndarray of (t, DM)-plane is
+    expected - ``numpy.asarray`` returns image expanded to the full time
+    resolution. Row-wise consumers (e.g. ``search.search_candidates_boxcar``)
+    use ``iter_rows`` and never expand it.
+
+    :param dm_grid:
+        Array-like of value of DM [cm^3/pc].
+    :param d_t:
+        Time step of original dynamical spectra [s].
+    :param n_t:
+        Number of time steps of original dynamical spectra.
+    """
+    def __init__(self, dm_grid, d_t, n_t):
+        self.dm_grid = np.atleast_1d(np.asarray(dm_grid, dtype=float))
+        self.d_t = d_t
+        self.n_t = n_t
+        # List of tuples (indexes of rows, factor, 2D array of rows)
+        self.blocks = list()
+
+    def __repr__(self):
+        return "MultiResolutionTDM(n_dm={}, n_t={}, factors={})".format(
+            len(self.dm_grid), self.n_t, [b[1] for b in self.blocks])
+
+    @property
+    def shape(self):
+        return len(self.dm_grid), self.n_t
+
+    @property
+    def nbytes(self):
+        return sum(b[2].nbytes for b in self.blocks)
+
+    def add_block(self, rows, factor, values):
+        """
+        Add block of rows with decimated time axis.
+
+        :param rows:
+            Array-like of indexes of rows (values of ``dm_grid``).
+        :param factor:
+            Factor of time decimation.
+        :param values:
+            2D numpy.ndarray with shape ``(len(rows), n_t // factor)``.
+        """
+        self.blocks.append((np.asarray(rows), factor, values))
+
+    def expand(self):
+        """
+        Expand image to the full time resolution.
+
+        :return:
+            2D numpy.ndarray with shape ``(len(dm_grid), n_t)``.
+        """
+        dtype = np.result_type(*[b[2] for b in self.blocks])
+        image = np.empty(self.shape, dtype=dtype)
+        for rows, factor, values in self.blocks:
+            n = values.shape[1] * factor
+            image[rows, :n] = np.repeat(values, factor, axis=1)
+            # Time steps beyond the last full decimated step
+            image[rows, n:] = values[:, -1:]
+        return image
+
+    def iter_rows(self):
+        """
+        Iterate over rows in their own time resolution.
+
+        :return:
+            Generator of tuples (index of row, factor of time decimation, 1D
+            numpy.ndarray of decimated row).
+        """
+        for rows, factor, values in self.blocks:
+            for row, row_values in zip(rows, values):
+                yield row, factor, row_values
+
+    def to_hdf5(self, group, **kwargs):
+        """
+        Save blocks to HDF5 group without expanding them.
+
+        :param group:
+            Instance of ``h5py.Group``.
+        :param kwargs:
+            Keyword arguments of ``h5py.Group.create_dataset`` (e.g.
+            ``compression``).
+        """
+        group.attrs['dm_grid'] = self.dm_grid
+        group.attrs['d_t'] = self.d_t
+        group.attrs['n_t'] = self.n_t
+        for i, (rows, factor, values) in enumerate(self.blocks):
+            dset = group.create_dataset(str(i), data=values, **kwargs)
+            dset.attrs['rows'] = rows
+            dset.attrs['factor'] = factor
+
+    @classmethod
+    def from_hdf5(cls, group):
+        """
+        Load instance saved by ``to_hdf5``.
+
+        :param group:
+            Instance of ``h5py.Group``.
+        """
+        tdm = cls(group.attrs['dm_grid'], float(group.attrs['d_t']),
+                  int(group.attrs['n_t']))
+        for i in range(len(group)):
+            dset = group[str(i)]
+            tdm.add_block(dset.attrs['rows'], int(dset.attrs['factor']),
+                          dset[...])
+        return tdm
+
+    def __array__(self, dtype=None):
+        image = self.expand()
+        if dtype is not None:
+            image = image.astype(dtype)
+        return image
+
+    def copy(self):
+        tdm = MultiResolutionTDM(self.dm_grid, self.d_t, self.n_t)
+        for rows, factor, values in self.blocks:
+            tdm.add_block(rows.copy(), factor, values.copy())
+        return tdm
+
+
+def _decimated_dedisperse(dsp, dm_grid, threads=1):
+    """
+    De-disperse dynamical spectra decimating time axis for values of DM where
+    smearing inside channel exceeds sampling time.
+
+    :return:
+        Instance of ``MultiResolutionTDM``.
+    """
+    dm_grid = np.asarray(dm_grid, dtype=float)
+    factors = decimation_factors(dsp.nu, dsp.d_nu, dsp.d_t.sec, dm_grid,
+                                 max_factor=dsp.n_t)
+    tdm = MultiResolutionTDM(dm_grid, dsp.d_t.sec, dsp.n_t)
+    for factor in np.unique(factors):
+        rows = np.flatnonzero(factors == factor)
+        n_t = dsp.n_t // factor
+        values = dsp.values[:, :n_t * factor]
+        sample_weights = dsp.sample_weights
+        if sample_weights is not None:
+            sample_weights = sample_weights[:, :n_t * factor]
+        if factor > 1:
+            # Weights of samples are applied before averaging
+            values = _fold_weights(values, sample_weights=sample_weights)
+            values = values.reshape((dsp.n_nu, n_t, factor)).mean(axis=2,
+                                                                  dtype=float)
+            values = values.astype(np.float32)
+            sample_weights = None
+        plan = get_plan(dsp.nu, dsp.d_t.sec * factor, dm_grid[rows])
+        if threads > 1:
+            frames = get_pool(threads).dedisperse(
+                values, plan, weights=dsp.weights,
+                sample_weights=sample_weights)
+        else:
+            frames = plan.dedisperse(values, weights=dsp.weights,
+                                     sample_weights=sample_weights)
+        tdm.add_block(rows, factor, frames / dsp.n_nu_eff)
+    return tdm
+
+
+def _subband_geometry(dsp, dm_grid, n_subbands):
+    """
+    Split channels on sub-bands and find nominal values of DM for the first
+    stage of sub-band de-dispersion.
+
+    :return:
+        Tuple of list of arrays with indexes of channels in each sub-band,
+        array of nominal values of DM [cm^3/pc] and array with index of
+        nominal value of DM for each value of ``dm_grid``.
+    """
+    dm_grid = np.asarray(dm_grid, dtype=float)
+    subbands = np.array_split(np.arange(dsp.n_nu), n_subbands)
+    # Maximum delay across sub-band for unit DM [s]
+    subband_delay = max(k * (1. / dsp.nu[s[0]] ** 2. -
+                             1. / dsp.nu[s[-1]] ** 2.) for s in subbands)
+    # Nominal values of DM are spaced on one time step of delay across
+    # sub-band. There is no use of nominal grid finer then ``dm_grid`` itself.
+    if subband_delay > 0:
+        d_dm = dsp.d_t.sec / subband_delay
+        indx = np.rint((dm_grid - dm_grid.min()) / d_dm).astype(int)
+        nominal_indx, dm_indx = np.unique(indx, return_inverse=True)
+        dm_nominal = dm_grid.min() + nominal_indx * d_dm
+    else:
+        dm_nominal, dm_indx = np.unique(dm_grid, return_inverse=True)
+    return subbands, dm_nominal, dm_indx
+
+
+def _subband_dedisperse(dsp, dm_grid, n_subbands, threads=1):
+    """
+    Two-stage de-dispersion. First, channels of each sub-band are de-dispersed
+    with nominal values of DM relative to the highest frequency of sub-band.
+    Second, sub-band time series are de-dispersed with values of ``dm_grid``
+    relative to the highest frequency of band. If ``threads > 1`` then both
+    stages use shared pool of worker processes (see ``get_pool``).
+    """
+    dm_grid = np.asarray(dm_grid, dtype=float)
+    subbands, dm_nominal, dm_indx = _subband_geometry(dsp, dm_grid,
+                                                      n_subbands)
+    d_t = dsp.d_t.sec
+    n_t = dsp.n_t
+    nu_refs = np.array([dsp.nu[s[-1]] for s in subbands])
+    pool = get_pool(threads) if threads > 1 else None
+
+    # First stage
+    subband_values = np.empty((len(dm_nominal), len(subbands), n_t))
+    for j, channels in enumerate(subbands):
+        plan = get_plan(dsp.nu[channels], d_t, dm_nominal)
+        band = slice(channels[0], channels[-1] + 1)
+        sample_weights = dsp.sample_weights
+        if sample_weights is not None:
+            sample_weights = sample_weights[band]
+        if pool is None:
+            plan.dedisperse(dsp.values[band], out=subband_values[:, j],
+                            weights=dsp.weights[band],
+                            sample_weights=sample_weights)
+        else:
+            pool.dedisperse(dsp.values[band], plan, out=subband_values[:, j],
+                            weights=dsp.weights[band],
+                            sample_weights=sample_weights)
+
+    # Second stage
+    tdm = np.empty((len(dm_grid), n_t))
+    for i in range(len(dm_nominal)):
+        indx = np.where(dm_indx == i)[0]
+        plan = get_plan(nu_refs, d_t, dm_grid[indx])
+        if pool is None:
+            tdm[indx] = plan.dedisperse(subband_values[i])
+        else:
+            tdm[indx] = pool.dedisperse(subband_values[i], plan)
+
+    return tdm / dsp.n_nu_eff
+
+
+def subband_smearing(dsp, dm_grid, n_subbands):
+    """
+    Upper bound of extra smearing of pulse introduced by sub-band
+    de-dispersion (see ``noncoherent_dedisperse``) compared to direct
+    de-dispersion.
+
+    :param dsp:
+        Instance of ``DynSpectra`` class.
+    :param dm_grid:
+        Array-like of value of DM on which to de-disperse [cm^3/pc].
+    :param n_subbands:
+        Number of sub-bands.
+
+    :return:
+        Numpy array of extra smearing [s] for each value of ``dm_grid``.
+
+    :note:
+        Bound includes difference between value of DM and nominal value of DM
+        used for its sub-band and one time step that could be lost on rounding
+        of shifts in two stages.
+    """
+    dm_grid = np.asarray(dm_grid, dtype=float)
+    subbands, dm_nominal, dm_indx = _subband_geometry(dsp, dm_grid,
+                                                      n_subbands)
+    subband_delay = max(k * (1. / dsp.nu[s[0]] ** 2. -
+                             1. / dsp.nu[s[-1]] ** 2.) for s in subbands)
+    return (abs(dm_grid - dm_nominal[dm_indx]) * subband_delay +
+            dsp.d_t.sec)
+
+
+def _next_power_of_two(n):
+    """
+    Smallest power of two that is not less than ``n``.
+    """
+    return 1 << int(np.ceil(np.log2(max(n, 1))))
+
+
+def _add_rolled(out, x, shift, subtract=False):
+    """
+    Add ``np.roll(x, -shift)`` to 1D array ``out`` in place without creating
+    rolled copy of ``x``. If ``subtract`` is ``True`` then subtract it.
+    """
+    n_t = len(x)
+    shift %= n_t
+    if subtract:
+        out[:n_t - shift] -= x[shift:]
+        out[n_t - shift:] -= x[:shift]
+    else:
+        out[:n_t - shift] += x[shift:]
+        out[n_t - shift:] += x[:shift]
+
+
+def _taylor_tree(data):
+    """
+    Sum 2D array along all straight lines with integer drift.
+
+    :param data:
+        2D numpy array (#slots, #t). Number of slots must be power of two.
+
+    :return:
+        2D numpy array (#slots, #t). Row ``d`` contains sums along lines that
+        drift on ``d`` time steps from the first slot to the last one (with
+        wrapping in time).
+    """
+    n_slots, n_t = data.shape
+    # Groups of adjacent slots with all drifts inside each group calculated
+    tree = np.array(data, dtype=float).reshape((n_slots, 1, n_t))
+    size = 1
+    while size < n_slots:
+        pairs = tree.reshape((-1, 2, size, n_t))
+        merged = np.empty((pairs.shape[0], 2 * size, n_t), dtype=float)
+        for drift in range(2 * size):
+            # Drift inside each half and shift of the second half
+            half = drift // 2
+            shift = drift - half
+            first = pairs[:, 0, half]
+            second = pairs[:, 1, half]
+            np.add(first[:, :n_t - shift], second[:, shift:],
+                   out=merged[:, drift, :n_t - shift])
+            np.add(first[:, n_t - shift:], second[:, :shift],
+                   out=merged[:, drift, n_t - shift:])
+        tree = merged
+        size *= 2
+    return tree[0]
+
+
+def tree_dedisperse(dsp, dm_grid):
+    """
+    De-disperse dynamical spectra with tree algorithm (Taylor, 1974) and
+    average them in frequency to obtain image in (t, DM)-plane.
+
+    :param dsp:
+        Instance of ``DynSpectra`` class.
+    :param dm_grid:
+        Array-like of value of DM on which to de-disperse [cm^3/pc].
+
+    :return:
+        2D numpy array (a.k.a. TDM-array) (#DM, #t)
+
+    :notes:
+        Frequency channels are placed on ``2 ** n >= n_nu`` slots uniformly
+        spaced in ``nu ** (-2)`` (close channels could share slot), so straight
+        lines of tree follow dispersion law within one slot. One pass of tree
+        gives all integer delays across band in range ``[0, 2 ** n)`` at cost
+        ``O(n_t * n_nu * log(n_nu))``. Larger delays are handled by
+        pre-shifting channels by multiples of ``2 ** n`` delays and repeating
+        tree only for those multiples that are needed for ``dm_grid``. Each
+        value of DM is de-dispersed with the nearest integer delay across band.
+
+    :note:
+        Use it for dense grid of DM values in a window far from zero DM (e.g.
+        to refine search around known DM), where only few stages are needed.
+        E.g. for 128 channels at 1684 MHz, 20000 time steps and 128 values of
+        DM with delays of 559 - 685 time steps across band it takes 0.12 s vs
+        0.43 s of ``noncoherent_dedisperse`` and 0.28 s of
+        ``fdmt_dedisperse``, that calculates all delays from zero. Grids that
+        start from zero DM are faster with ``fdmt_dedisperse`` (0.06 s vs
+        0.08 s for delays of 0 - 125 time steps). Sparse grids with delays of
+        many stages are faster with ``noncoherent_dedisperse`` (0.28 s vs
+        2.7 s for 256 channels at 340 MHz and 32 values of DM up to 1000).
+    """
+    dm_grid = np.atleast_1d(np.asarray(dm_grid, dtype=float))
+    # Order channels from highest frequency to lowest one
+    nu = dsp.nu[::-1]
+    weights, channels = _check_weights(dsp.weights)
+    # Channels are weighted one at a time while they are added to slots
+    values = _fold_weights(dsp.values,
+                           sample_weights=dsp.sample_weights)[::-1]
+    weights = _kernel_weights(weights)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)[::-1]
+    n_nu, n_t = values.shape
+    d_t = dsp.d_t.sec
+    if channels is None:
+        channels = np.arange(n_nu)
+    # Indexes of channels with non-zero weights in reversed order
+    channels = (n_nu - 1 - channels)[::-1]
+
+    # Dispersion delays of channels in units of delay across band
+    inv_nu2 = 1. / nu ** 2. - 1. / nu[0] ** 2.
+    profile = inv_nu2 / inv_nu2[-1]
+    n_slots = _next_power_of_two(n_nu)
+    slots = np.rint(profile * (n_slots - 1)).astype(int)
+
+    # Delays across band [time steps] for all values of DM
+    band_delays = np.rint(k * dm_grid * inv_nu2[-1] / d_t).astype(int)
+    stages = band_delays // n_slots
+
+    tdm = np.empty((len(dm_grid), n_t), dtype=float)
+    for stage in np.unique(stages):
+        base = stage * n_slots
+        shifts = np.rint(base * profile).astype(int)
+        slotted = np.zeros((n_slots, n_t), dtype=float)
+        for i in channels:
+            row = values[i] if weights is None else weights[i] * values[i]
+            _add_rolled(slotted[slots[i]], row, shifts[i])
+        tree = _taylor_tree(slotted)
+        indx = stages == stage
+        tdm[indx] = tree[band_delays[indx] - base]
+
+    return tdm / dsp.n_nu_eff
+
+
+def fdmt_dm_grid(dsp, dm_max):
+    """
+    Values of DM that correspond to rows of ``fdmt_dedisperse`` output when it
+    is called with maximum value of DM. Values are spaced uniformly with step
+    that corresponds to one time step of delay across band.
+
+    :param dsp:
+        Instance of ``DynSpectra`` class.
+    :param dm_max:
+        Maximum value of DM [cm^3/pc].
+
+    :return:
+        Numpy array of DM values [cm^3 / pc].
+    """
+    band_delay = k * (1. / dsp.nu[0] ** 2. - 1. / dsp.nu_0 ** 2.) / dsp.d_t.sec
+    max_delay = int(np.ceil(band_delay * dm_max))
+    return np.arange(max_delay + 1) / band_delay
+
+
+def _fdmt(values, nu, max_delay, weights=None):
+    """
+    Recursive part of FDMT. Sum sub-band along all dispersion tracks with
+    integer delays across sub-band.
+
+    :param values:
+        2D numpy array (#nu, #t) with channels ordered from highest frequency
+        to lowest one.
+    :param nu:
+        Numpy array of frequencies of channels [MHz] in the same order.
+    :param max_delay:
+        Maximum delay across band [time steps].
+    :param weights: (optional)
+        Numpy array of weights of channels in the same order. Each channel is
+        multiplied by its weight when it enters transform. If ``None`` then
+        all weights are ones. (default: ``None``)
+
+    :return:
+        2D numpy array (#delays, #t). Row ``d`` contains sum along track with
+        delay ``d`` between the first and the last channels.
+    """
+    n_t = values.shape[1]
+    inv_nu2 = 1. / nu ** 2.
+    span = inv_nu2[-1] - inv_nu2[0]
+
+    def transform(start, stop):
+        if stop - start == 1:
+            if weights is not None:
+                return weights[start] * values[start][np.newaxis, :]
+            return values[start][np.newaxis, :]
+        middle = (start + stop) // 2
+        upper = transform(start, middle)
+        lower = transform(middle, stop)
+        sub_span = inv_nu2[stop - 1] - inv_nu2[start]
+        n_delays = int(np.ceil(max_delay * sub_span / span)) + 1
+        result = np.empty((n_delays, n_t), dtype=float)
+        for delay in range(n_delays):
+            # Delay from the first channel of sub-band to the first and the
+            # last channels of the lower half
+            offset = int(round(delay * (inv_nu2[middle] - inv_nu2[start]) /
+                               sub_span))
+            d_upper = int(round(delay * (inv_nu2[middle - 1] -
+                                         inv_nu2[start]) / sub_span))
+            d_upper = min(d_upper, len(upper) - 1)
+            d_lower = min(delay - offset, len(lower) - 1)
+            result[delay] = upper[d_upper]
+            _add_rolled(result[delay], lower[d_lower], offset)
+        return result
+
+    return transform(0, len(nu))
+
+
+def fdmt_dedisperse(dsp, dm_grid):
+    """
+    De-disperse dynamical spectra with Fast Dispersion Measure Transform
+    (Zackay & Ofek, 2017) and average them in frequency to obtain image in
+    (t, DM)-plane.
+
+    :param dsp:
+        Instance of ``DynSpectra`` class.
+    :param dm_grid:
+        Array-like of non-negative value of DM on which to de-disperse
+        [cm^3/pc]. If scalar then it is treated as maximum value of DM and all
+        integer delays across band up to this DM are returned (see
+        ``fdmt_dm_grid``).
+
+    :return:
+        2D numpy array (a.k.a. TDM-array) (#DM, #t)
+
+    :notes:
+        Sub-bands are merged pairwise, so tracks with all integer delays across
+        band up to maximum one are found at cost ``O(n_t * (n_delays *
+        log(n_nu) + n_nu))`` for any time shifts between neighbouring channels.
+        Each channel contributes one sample to track (as in
+        ``noncoherent_dedisperse``), so values are directly comparable with
+        other engines. Cost grows with maximum delay even if ``dm_grid`` is a
+        narrow window at large DM, then ``tree_dedisperse`` is faster.
+    """
+    dm_grid = _check_dm_grid(dm_grid)
+    # Order channels from highest frequency to lowest one
+    nu = dsp.nu[::-1]
+    weights, _ = _check_weights(dsp.weights)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)[::-1]
+    values = _fold_weights(dsp.values,
+                           sample_weights=dsp.sample_weights)[::-1]
+    band_delay = k * (1. / nu[-1] ** 2. - 1. / nu[0] ** 2.) / dsp.d_t.sec
+
+    if np.ndim(dm_grid) == 0:
+        max_delay = int(np.ceil(band_delay * dm_grid))
+        return _fdmt(values, nu, max_delay, weights) / dsp.n_nu_eff
+
+    delays = np.rint(band_delay * dm_grid).astype(int)
+    tdm = _fdmt(values, nu, delays.max(), weights)
+    return tdm[delays] / dsp.n_nu_eff
+
+
+def coherent_dedisperse(voltages, nu_ref, bandwidth, dm, sideband='U',
+                        n_fft=None):
+    """
+    Coherently de-disperse real-sampled voltages of one baseband channel with
+    chirp filter applied by overlap-save FFTs.
+
+    :param voltages:
+        1D array-like of real voltages sampled with Nyquist rate
+        ``2 * bandwidth``.
+    :param nu_ref:
+        Reference (LO) frequency of channel [MHz]. It is the lowest frequency
+        of upper side band and the highest frequency of lower side band.
+    :param bandwidth:
+        Bandwidth of channel [MHz].
+    :param dm:
+        Dispersion measure [cm^3/pc]. Negative values disperse voltages.
+    :param sideband: (optional)
+        ``U`` or ``L``. (default: ``U``)
+    :param n_fft: (optional)
+        Size of FFT. It must exceed dispersion delay across channel (in
+        samples). If ``None`` then use power of two not less then four times
+        this delay. (default: ``None``)
+
+    :return:
+        Numpy array of de-dispersed voltages with the same length as
+        ``voltages``. Samples are aligned on the arrival time at ``nu_ref``.
+        Samples closer to the edge than delay across channel are incomplete.
+    """
+    voltages = np.asarray(voltages, dtype=float)
+    n = len(voltages)
+    sb = {'U': 1., 'L': -1.}[sideband]
+    d_t = 1. / (2. * bandwidth * 1e6)
+    # Delay across channel [samples]
+    nu_edge = nu_ref + sb * bandwidth
+    n_overlap = int(np.ceil(abs(k * dm * (1. / nu_edge ** 2. -
+                                          1. / nu_ref ** 2.)) / d_t))
+    if n_fft is None:
+        n_fft = _next_power_of_two(max(4 * n_overlap, 2 ** 14))
+    if n_fft <= n_overlap:
+        raise Exception("Size of FFT {} doesn't exceed delay across channel"
+                        " {}".format(n_fft, n_overlap))
+
+    # Sky frequencies of FFT bins [MHz]
+    nu = nu_ref + sb * np.fft.rfftfreq(n_fft, d_t) / 1e6
+    # Phase of de-dispersing filter without constant and linear (pure delay)
+    # terms of expansion around ``nu_ref``. It advances each component by its
+    # dispersion delay relative to ``nu_ref``.
+    chirp = np.exp(-2j * np.pi * 1e6 * sb * k * dm * (nu - nu_ref) ** 2. /
+                   (nu * nu_ref ** 2.))
+
+    # Components are delayed (upper side band) or advanced (lower side band).
+    # For delayed ones each block must start ``n_overlap`` samples earlier.
+    lead = n_overlap if sb * dm > 0 else 0
+    step = n_fft - n_overlap
+    n_blocks = int(np.ceil(float(n) / step))
+    padded = np.zeros(lead + n_blocks * step + n_overlap)
+    padded[lead: lead + n] = voltages
+    blocks = as_strided(padded, shape=(n_blocks, n_fft),
+                        strides=(step * padded.strides[0],
+                                 padded.strides[0]))
+    result = np.empty(n_blocks * step)
+    # Batch of blocks to keep spectra within ``2 ** 22`` elements
+    batch = max(1, 2 ** 22 // n_fft)
+    for start in range(0, n_blocks, batch):
+        stop = min(start + batch, n_blocks)
+        spectra = np.fft.rfft(blocks[start: stop], axis=1)
+        spectra *= chirp
+        filtered = np.fft.irfft(spectra, n=n_fft, axis=1)
+        result[start * step: stop * step] = \
+            filtered[:, lead: lead + step].ravel()
+    return result[:n]
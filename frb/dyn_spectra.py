@@ -1,9 +1,9 @@
 # -*- coding: utf-8 -*-
-import multiprocessing
-import ctypes
 import numpy as np
-import pickle_method
-from utils import vint, vround, read_hdf5
+from storage import (create_storage, is_in_memory, is_writeable, open_hdf5,
+                     read_into)
+from dedispersion import (DedispersionPlan, channel_smearing, get_plan,
+                          get_pool)
 from astropy.time import Time, TimeDelta
 
 try:
@@ -84,27 +84,53 @@ class DynSpectra(object):
     :param t_0: (optional)
         Time of first measurement. Instance of ``astropy.time.Time`` class. If
         ``None`` then use time of initialization. (default: ``None``)
+    :param values: (optional)
+        Array-like (#ch, #t,) to use as values without copying (e.g.
+        ``numpy.memmap`` or ``h5py.Dataset`` opened by ``create_from_hdf5``).
+        If ``None`` then create array of zeros with ``backend``. (default:
+        ``None``)
+    :param backend: (optional)
+        Storage of values: ``shared`` (shared memory), ``numpy``, ``memmap``
+        or ``hdf5`` (see ``storage``). If ``None`` then ``shared`` is used for
+        new array of zeros and backend of ``values`` is detected (plain numpy
+        array is ``numpy``). (default: ``None``)
+    :param fname: (optional)
+        File to keep values in for ``memmap`` and ``hdf5`` backends.
+        (default: ``None``)
 
     """
-    def __init__(self, n_nu, n_t, nu_0, d_nu, d_t, meta_data=None, t_0=None):
+    def __init__(self, n_nu, n_t, nu_0, d_nu, d_t, meta_data=None, t_0=None,
+                 values=None, backend=None, fname=None):
         self.n_nu = n_nu
         self.n_t = n_t
         self.nu_0 = nu_0
         self.t_0 = t_0 or Time.now()
-        # Using shared array (http://stackoverflow.com/questions/5549190 by pv.)
-        shared_array_base = multiprocessing.Array(ctypes.c_float, n_nu * n_t)
-        self.values =\
-            np.ctypeslib.as_array(shared_array_base.get_obj()).reshape((n_nu,
-                                                                        n_t,))
+        if values is None:
+            backend = backend or 'shared'
+            values = create_storage(n_nu, n_t, backend=backend, fname=fname)
+        elif isinstance(values, np.memmap):
+            backend = 'memmap'
+        elif not is_in_memory(values):
+            backend = getattr(values, 'backend', 'hdf5')
+        elif backend is None:
+            # Views of shared arrays pass their backend explicitly
+            backend = 'numpy'
+        assert tuple(values.shape) == (n_nu, n_t)
+        self.backend = backend
+        self.values = values
+        # Array that holds ``values`` and has room for appended time steps
+        self._buffer = self.values
+        # The same for ``sample_weights``
+        self._weights_buffer = None
 
         nu = np.arange(n_nu)
-        t = np.arange(n_t)
         self.nu = (nu_0 - nu * d_nu)[::-1]
         self.d_t = TimeDelta(d_t, format='sec')
-        self.t = self.t_0 + t * self.d_t
-        self.t_end = self.t[-1]
         self.d_nu = d_nu
         self.meta_data = MetaData(meta_data)
+        # Weights of frequency channels & (optionally) of individual samples
+        self.weights = np.ones(n_nu)
+        self.sample_weights = None
 
     def __repr__(self):
         outprint = "# channels: {}\n".format(self.n_nu)
@@ -122,6 +148,130 @@ class DynSpectra(object):
         """
         return self.n_t * self.d_t.sec, self.n_nu * self.d_nu
 
+    def time_offsets(self, indexes=None):
+        """
+        Times of time steps relative to ``t_0``.
+
+        :param indexes: (optional)
+            Index or array-like of indexes of time steps. If ``None`` then use
+            all time steps. (default: ``None``)
+
+        :return:
+            Numpy array of offsets [s].
+        """
+        if indexes is None:
+            indexes = np.arange(self.n_t)
+        return np.asarray(indexes) * self.d_t.sec
+
+    def times(self, indexes=None):
+        """
+        Times of time steps.
+
+        :param indexes: (optional)
+            Index or array-like of indexes of time steps. If ``None`` then use
+            all time steps. (default: ``None``)
+
+        :return:
+            Instance of ``astropy.time.Time``.
+        """
+        return self.t_0 + TimeDelta(self.time_offsets(indexes), format='sec')
+
+    @property
+    def t(self):
+        """
+        Times of all time steps (instance of ``astropy.time.Time``). It is
+        created on each access - use ``times`` or ``time_offsets`` for
+        selected time steps.
+        """
+        return self.times()
+
+    @property
+    def t_end(self):
+        """
+        Time of the last time step.
+        """
+        return self.t_0 + (self.n_t - 1) * self.d_t
+
+    @property
+    def n_nu_eff(self):
+        """
+        Effective number of channels - sum of weights of channels. It is used
+        to average de-dispersed dynamical spectra in frequency.
+        """
+        n_nu_eff = float(np.sum(self.weights))
+        if not n_nu_eff:
+            raise Exception("All channels are masked")
+        return n_nu_eff
+
+    def mask_channels(self, channels):
+        """
+        Mask frequency channels (e.g. band edges or channels with RFI). Masked
+        channels are skipped by de-dispersion.
+
+        :param channels:
+            Index, slice or array-like of indexes (or boolean mask) of
+            channels.
+        """
+        self.weights[channels] = 0.
+
+    def mask_samples(self, mask):
+        """
+        Mask individual samples of dynamical spectra.
+
+        :param mask:
+            Boolean array-like (#ch, #t,) where ``True`` marks bad samples.
+
+        :note:
+            Masked samples contribute zero to de-dispersed values that are
+            still averaged over all unmasked channels. So data should have
+            zero baseline.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        assert mask.shape == self.values.shape
+        if self.sample_weights is None:
+            self.sample_weights = np.ones(self.values.shape, dtype=np.float32)
+        self.sample_weights[mask] = 0.
+
+    def append(self, array):
+        """
+        Append time steps to dynamical spectra. Memory is reserved with margin,
+        so on average cost of appending is proportional to number of appended
+        time steps.
+
+        :param array:
+            Array-like of dyn. spectra (#ch, #t,) to append.
+
+        :note:
+            ``values`` becomes a view of internal buffer (with non-contiguous
+            rows). Only ``shared`` and ``numpy`` backends support appending.
+        """
+        if self.backend not in ('shared', 'numpy'):
+            raise Exception("Can't append to {} backend".format(self.backend))
+        array = np.atleast_2d(array)
+        assert array.shape[0] == self.n_nu
+        n_t = self.n_t + array.shape[1]
+        if n_t > self._buffer.shape[1]:
+            buffer_ = create_storage(self.n_nu,
+                                     max(n_t, 2 * self._buffer.shape[1]),
+                                     backend=self.backend)
+            buffer_[:, :self.n_t] = self.values
+            self._buffer = buffer_
+        self._buffer[:, self.n_t: n_t] = array
+        self.values = self._buffer[:, :n_t]
+        if self.sample_weights is not None:
+            # Weights of samples are kept in buffer of the same size
+            weights_buffer = self._weights_buffer
+            if (weights_buffer is None or
+                    self.sample_weights.base is not weights_buffer or
+                    n_t > weights_buffer.shape[1]):
+                weights_buffer = np.empty(self._buffer.shape,
+                                          dtype=np.float32)
+                weights_buffer[:, :self.n_t] = self.sample_weights
+                self._weights_buffer = weights_buffer
+            weights_buffer[:, self.n_t: n_t] = 1.
+            self.sample_weights = weights_buffer[:, :n_t]
+        self.n_t = n_t
+
     def add_values(self, array):
         """
         Add dyn. spectra in form of numpy array (#ch, #t,) to instance.
@@ -130,13 +280,134 @@ class DynSpectra(object):
             Array-like of dynamical spectra (#ch, #t,).
         """
         array = np.atleast_2d(array)
-        assert self.values.shape == array.shape
-        self.values += array
+        assert tuple(self.values.shape) == array.shape
+        self._check_writeable()
+        if is_in_memory(self.values):
+            self.values += array
+        else:
+            self.values[...] = self.values[...] + array
+
+    def _check_writeable(self):
+        """
+        Check that values could be changed in place.
+        """
+        if not is_writeable(self.values):
+            raise ValueError("Values of {} backend are read-only. Use writable"
+                             " backend (e.g. load data by ``create_from_hdf5``"
+                             " with default backend)".format(self.backend))
+
+    def view(self, start=None, stop=None):
+        """
+        Select time steps without copying data.
+
+        :param start: (optional)
+            Index of the first time step. If ``None`` then start from the
+            beginning. (default: ``None``)
+        :param stop: (optional)
+            Index of time step after the last one. If ``None`` then select up
+            to the end. (default: ``None``)
+
+        :return:
+            Instance of ``DynSpectra`` class with ``t_0`` of the first selected
+            time step. Its ``values`` (and ``sample_weights``) share memory
+            with the current instance, so changes of values are seen by both.
+            Weights of channels are copied. For ``hdf5`` backend selected time
+            steps are read to memory.
+        """
+        start, stop, _ = slice(start, stop).indices(self.n_t)
+        stop = max(start, stop)
+        values = self.values[:, start: stop]
+        backend = self.backend if is_in_memory(self.values) else 'numpy'
+        frame = DynSpectra(self.n_nu, stop - start, self.nu_0, self.d_nu,
+                           self.d_t, meta_data=self.meta_data,
+                           t_0=self.t_0 + start * self.d_t, values=values,
+                           backend=backend)
+        frame.weights = self.weights.copy()
+        if self.sample_weights is not None:
+            frame.sample_weights = self.sample_weights[:, start: stop]
+        return frame
+
+    def time_view(self, t_start=None, t_stop=None):
+        """
+        Select time interval without copying data (see ``view``).
+
+        :param t_start: (optional)
+            Start of interval - instance of ``astropy.time.Time`` or offset
+            from ``t_0`` [s]. If ``None`` then start from the beginning.
+            (default: ``None``)
+        :param t_stop: (optional)
+            End of interval (not included) - instance of ``astropy.time.Time``
+            or offset from ``t_0`` [s]. If ``None`` then select up to the end.
+            (default: ``None``)
+
+        :return:
+            Instance of ``DynSpectra`` class.
+        """
+        return self.view(self._time_index(t_start), self._time_index(t_stop))
+
+    def _time_index(self, t):
+        """
+        Index of the first time step not earlier than ``t`` (instance of
+        ``astropy.time.Time`` or offset from ``t_0`` [s]).
+        """
+        if t is None:
+            return None
+        if isinstance(t, Time):
+            t = (t - self.t_0).sec
+        index = int(np.ceil(t / self.d_t.sec - 1e-6))
+        return min(max(index, 0), self.n_t)
+
+    def max_delay(self, dm):
+        """
+        Dispersion delay across band.
+
+        :param dm:
+            Dispersion measure [cm^3 / pc].
+
+        :return:
+            Delay of the lowest frequency channel relative to the highest one
+            [s].
+        """
+        return float(DedispersionPlan(self.nu, self.d_t.sec,
+                                      [dm]).delays.max())
+
+    def iter_chunks(self, duration, overlap=0., dm_max=None):
+        """
+        Iterate over consecutive chunks of dynamical spectra. Chunks are views
+        (see ``view``), so data is not copied (for ``hdf5`` backend each chunk
+        is read when it is created).
+
+        :param duration:
+            Time between starts of chunks [s].
+        :param overlap: (optional)
+            Time that each chunk extends into the next one [s]. (default:
+            ``0.``)
+        :param dm_max: (optional)
+            Maximum DM to search [cm^3 / pc]. If not ``None`` then overlap is
+            at least dispersion delay across band for this DM, so any pulse
+            that starts in chunk (at the highest frequency) is entirely in it.
+            (default: ``None``)
+
+        :return:
+            Generator of ``DynSpectra`` instances. The last chunk ends at the
+            end of data.
+        """
+        if dm_max is not None:
+            overlap = max(overlap, self.max_delay(dm_max))
+        n_step = int(round(duration / self.d_t.sec))
+        if n_step < 1:
+            raise Exception("Duration of chunks is less than time step")
+        n_overlap = int(np.ceil(overlap / self.d_t.sec - 1e-6))
+        for start in range(0, self.n_t, n_step):
+            stop = start + n_step + n_overlap
+            yield self.view(start, stop)
+            if stop >= self.n_t:
+                break
 
-    # FIXME: Handle start time in slices somehow
     def slice(self, t_start, t_stop):
         """
-        Slice frame using specified fractions of time interval.
+        Slice frame using specified fractions of time interval. Data is copied
+        (see ``view`` for slicing without copying).
 
         :param t_start:
             Number [0, 1] - fraction of total time interval.
@@ -149,9 +420,76 @@ class DynSpectra(object):
         assert t_start < t_stop
         frame = DynSpectra(self.n_nu, int(round(self.n_t * (t_stop - t_start))),
                            self.nu_0, self.d_nu, self.d_t,
-                           meta_data=self.meta_data, t_0=self.t_0)
+                           meta_data=self.meta_data,
+                           t_0=self.t_0 + int(t_start * self.n_t) * self.d_t)
+        # Only selected time steps are read from the backing store
         frame.add_values(self.values[:, int(t_start * self.n_t): int(t_stop *
                                                                      self.n_t)])
+        frame.weights = self.weights.copy()
+        if self.sample_weights is not None:
+            frame.sample_weights =\
+                self.sample_weights[:, int(t_start * self.n_t):
+                                    int(t_stop * self.n_t)].copy()
+        return frame
+
+    def downsample(self, t_factor=1, nu_factor=1):
+        """
+        Average neighbouring time steps and frequency channels.
+
+        :param t_factor: (optional)
+            Number of time steps to average. (default: ``1``)
+        :param nu_factor: (optional)
+            Number of frequency channels to average. (default: ``1``)
+
+        :return:
+            Instance of ``DynSpectra`` class with ``n_t // t_factor`` time
+            steps and ``n_nu // nu_factor`` channels. Remaining time steps at
+            the end and lowest frequency channels are discarded. ``t_0`` and
+            ``nu_0`` are centers of the first time step and of the highest
+            channel.
+
+        :note:
+            Masked channels and samples (see ``mask_channels`` and
+            ``mask_samples``) are excluded from averages. New weights are
+            averages of old ones.
+        """
+        n_t = self.n_t // t_factor
+        n_nu = self.n_nu // nu_factor
+        if not n_t or not n_nu:
+            raise Exception("Factors exceed dimensions of dynamical spectra")
+        rows = slice(self.n_nu - n_nu * nu_factor, self.n_nu)
+        cols = slice(0, n_t * t_factor)
+        shape = (n_nu, nu_factor, n_t, t_factor)
+        values = self.values[rows, cols].reshape(shape)
+        nu_0 = self.nu_0 - (nu_factor - 1) * self.d_nu / 2.
+        frame = DynSpectra(n_nu, n_t, nu_0, self.d_nu * nu_factor,
+                           self.d_t.sec * t_factor,
+                           meta_data=self.meta_data,
+                           t_0=self.t_0 + (t_factor - 1) / 2. * self.d_t)
+        weights = self.weights[rows]
+        frame.weights = weights.reshape((n_nu, nu_factor)).mean(axis=1)
+        if self.sample_weights is None and np.all(weights == 1):
+            frame.values[:] = values.mean(axis=(1, 3))
+            return frame
+
+        # Weighted averages
+        sample_weights = np.empty((n_nu * nu_factor, n_t * t_factor),
+                                  dtype=np.float32)
+        if self.sample_weights is None:
+            sample_weights[:] = 1.
+        else:
+            sample_weights[:] = self.sample_weights[rows, cols]
+        sample_weights *= weights[:, np.newaxis]
+        sample_weights = sample_weights.reshape(shape)
+        norm = sample_weights.sum(axis=(1, 3))
+        sums = (values * sample_weights).sum(axis=(1, 3))
+        frame.values[:] = np.true_divide(sums, norm, where=norm > 0,
+                                         out=np.zeros(norm.shape))
+        if self.sample_weights is not None:
+            frame.sample_weights = np.true_divide(
+                norm, nu_factor * t_factor * frame.weights[:, np.newaxis],
+                where=frame.weights[:, np.newaxis] > 0,
+                out=np.zeros(norm.shape)).astype(np.float32)
         return frame
 
     def _de_disperse_by_value(self, dm):
@@ -161,19 +499,13 @@ class DynSpectra(object):
         :param dm:
             Dispersion measure to use in de-dispersion [cm^3 / pc].
         """
-        # MHz ** 2 * cm ** 3 * s / pc
-        k = 1. / (2.410331 * 10 ** (-4))
-
-        # Calculate shift of time caused by de-dispersion for all channels
-        dt_all = k * dm * (1. / self.nu ** 2. - 1. / self.nu_0 ** 2.)
-        # Find what number of time bins corresponds to this shifts
-        nt_all = vint(vround(dt_all / self.d_t.sec))
-        # Roll each axis (freq. channel) to each own number of time steps.
-        values = list()
-        for i in range(self.n_nu):
-            values.append(np.roll(self.values[i], -nt_all[i]))
-        values = np.vstack(values)
-
+        plan = get_plan(self.nu, self.d_t.sec, dm)
+        # Values of any storage are read to new array & each axis (freq.
+        # channel) is rolled there to each own number of time steps.
+        values = read_into(self.values, np.empty((self.n_nu, self.n_t),
+                                                 dtype=self.values.dtype))
+        for row, shift in zip(values, plan.shifts[0]):
+            row[:] = np.roll(row, -shift)
         return values
 
     def _de_disperse_by_value_freq_average(self, dm):
@@ -189,20 +521,10 @@ class DynSpectra(object):
             averaged de-dispersed dyn. spectra.
 
         """
-        # MHz ** 2 * cm ** 3 * s / pc
-        k = 1. / (2.410331 * 10 ** (-4))
-
-        # Calculate shift of time caused by de-dispersion for all channels
-        dt_all = k * dm * (1. / self.nu ** 2. - 1. / self.nu_0 ** 2.)
-        # Find what number of time bins corresponds to this shifts
-        nt_all = vint(vround(dt_all / self.d_t.sec))
-        # Container for summing de-dispersed frequency channels
-        values = np.zeros(self.n_t)
-        # Roll each axis (freq. channel) to each own number of time steps.
-        for i in range(self.n_nu):
-            values += np.roll(self.values[i], -nt_all[i])
-
-        return values / self.n_nu
+        plan = get_plan(self.nu, self.d_t.sec, dm)
+        return plan.dedisperse(self.values, weights=self.weights,
+                               sample_weights=self.sample_weights)[0] /\
+            self.n_nu_eff
 
     def de_disperse_cumsum(self, dm_values):
         """
@@ -212,51 +534,18 @@ class DynSpectra(object):
             Array-like of DM values to de-disperse [cm^3 /pc].
 
         :return:
-            2D numpy array (a.k.a. TDM-array) (#DM, #t)
+            2D numpy array (a.k.a. TDM-array) (#DM, #t) of (weighted) sums
+            over frequency.
 
         :notes:
-            Probably, it won't work (at least efficiently) when time shift
-            between close frequency channels > one time interval.
+            Uses cumulative sums over channels and tables of segments of
+            channels with equal time shifts (see
+            ``DedispersionPlan.dedisperse_cumsum``), so it handles any jumps
+            of time shifts between neighbouring channels.
         """
-        # MHz ** 2 * cm ** 3 * s / pc
-        k = 1. / (2.410331 * 10 ** (-4))
-
-        # Frequency of highest frequency channel [MHz].
-        nu_max = self.nu_0
-        # Time step [s].
-        d_t = self.d_t.sec
-        dm_values = np.array(dm_values)
-        n_nu = self.n_nu
-        n_t = self.n_t
-        nu = self.nu
-        # Pre-calculating cumulative sums and their difference
-        cumsums = np.ma.cumsum(self.values[::-1, :], axis=0)
-        dcumsums = np.roll(cumsums, 1, axis=1) - cumsums
-
-        # Calculate shift of time caused by de-dispersion for all channels and
-        # all values of DM
-        dt_all = k * dm_values[:, np.newaxis] * (1. / nu ** 2. -
-                                                 1. / nu_max ** 2.)
-        # Find what number of time bins corresponds to this shifts
-        nt_all = vint(vround(dt_all / d_t))[:, ::-1]
-
-        # Create array for TDM
-        values = np.zeros((len(dm_values), n_t), dtype=float)
-        # FIXME: Generally there could be nonzero list of DM values
-        # Fill DM=0 row
-        values[0] = cumsums[-1]
-
-        # Cycle over DM values and fill TDM array for others DM values
-        for i, nt in enumerate(nt_all[1:]):
-            # Find at which frequency channels time shifts have occurred
-            indx = np.array(np.where(nt[1:] - nt[:-1] == 1)[0].tolist() +
-                            [n_nu - 1])
-            result = np.roll(cumsums[-1], -nt[-1])
-            for ix, j in enumerate(indx[:-1]):
-                result += np.roll(dcumsums[j], -nt[j])
-            values[i + 1] = result
-
-        return values
+        plan = get_plan(self.nu, self.d_t.sec, dm_values)
+        return plan.dedisperse_cumsum(self.values, weights=self.weights,
+                                      sample_weights=self.sample_weights)
 
     # TODO: if one choose what channels to plot - use ``extent`` kwarg.
     def plot(self, plot_indexes=True, savefig=None):
@@ -290,18 +579,7 @@ class DynSpectra(object):
             Dispersion measure of pulse [cm^3 / pc].
 
         """
-        t_0 = TimeDelta(t_0, format='sec')
-
-        # MHz ** 2 * cm ** 3 * s / pc
-        k = 1. / (2.410331 * 10 ** (-4))
-
-        # Calculate arrival times for all channels
-        t0_all = (t_0.sec * np.ones(self.n_nu)[:, np.newaxis] +
-                  k * dm * (1. / self.nu ** 2. -
-                            1. / self.nu_0 ** 2.))[0]
-        pulse = amp * np.exp(-0.5 * ((self.t - self.t_0).sec -
-                                     t0_all[:, np.newaxis]) ** 2 / width ** 2.)
-        self.values += pulse
+        self.add_pulses([(t_0, amp, width, dm)])
 
     def rm_pulse(self, t_0, amp, width, dm):
         """
@@ -320,6 +598,75 @@ class DynSpectra(object):
         """
         self.add_pulse(t_0, -amp, width, dm)
 
+    def add_pulses(self, table, n_widths=6.):
+        """
+        Add several pulses to frame.
+
+        :param table:
+            Array-like (#pulses, 4) with rows of ``t_0`` [s], ``amp``,
+            ``width`` [s] and ``dm`` [cm^3 / pc] of pulses (see
+            ``add_pulse``).
+        :param n_widths: (optional)
+            Pulses are evaluated only within this number of widths from their
+            dispersed tracks. (default: ``6.``)
+
+        :note:
+            All pulses are evaluated at once, so cost is proportional to total
+            number of samples in windows around their tracks.
+        """
+        table = np.atleast_2d(np.asarray(table, dtype=float))
+        if not table.size:
+            return
+        t_0, amp, width, dm = table.T
+        d_t = self.d_t.sec
+        # Arrival times at all channels (#pulses, #ch)
+        arrivals = t_0[:, np.newaxis] + DedispersionPlan(self.nu, d_t,
+                                                         dm).delays
+        n_half = np.ceil(n_widths * width / d_t).astype(int)
+        offsets = np.arange(-n_half.max(), n_half.max() + 1)
+        # Time steps of windows around tracks (#pulses, #ch, #window)
+        cols = np.rint(arrivals / d_t).astype(int)[..., np.newaxis] + offsets
+        rows = np.broadcast_to(np.arange(self.n_nu)[:, np.newaxis],
+                               cols.shape)
+        valid = ((cols >= 0) & (cols < self.n_t) &
+                 (abs(offsets) <= n_half[:, np.newaxis, np.newaxis]))
+        width = np.broadcast_to(width[:, np.newaxis, np.newaxis],
+                                cols.shape)[valid]
+        amp = np.broadcast_to(amp[:, np.newaxis, np.newaxis],
+                              cols.shape)[valid]
+        arrivals = np.broadcast_to(arrivals[..., np.newaxis],
+                                   cols.shape)[valid]
+        rows = rows[valid]
+        cols = cols[valid]
+        pulses = amp * np.exp(-0.5 * (cols * d_t - arrivals) ** 2 /
+                              width ** 2.)
+        self._add_at(rows, cols, pulses)
+
+    def rm_pulses(self, table, n_widths=6.):
+        """
+        Remove several pulses from frame (see ``add_pulses``).
+        """
+        table = np.array(table, dtype=float, ndmin=2)
+        if not table.size:
+            return
+        table[:, 1] *= -1
+        self.add_pulses(table, n_widths=n_widths)
+
+    def _add_at(self, rows, cols, values):
+        """
+        Add values to samples with given indexes (repeated indexes are
+        accumulated).
+        """
+        self._check_writeable()
+        if is_in_memory(self.values):
+            np.add.at(self.values, (rows, cols), values)
+        elif hasattr(self.values, 'add_at'):
+            self.values.add_at((rows, cols), values)
+        else:
+            array = np.zeros(self.values.shape, dtype=np.float32)
+            np.add.at(array, (rows, cols), values)
+            self.add_values(array)
+
     def add_noise(self, std):
         """
         Add noise to frame using specified rayleigh-distributed noise.
@@ -327,13 +674,15 @@ class DynSpectra(object):
         :param std:
             Std of rayleigh-distributed uncorrelated noise.
         """
+        self._check_writeable()
         noise =\
             np.random.rayleigh(std,
                                size=(self.n_t *
                                      self.n_nu)).reshape(np.shape(self.values))
-        self.values += noise
+        self.add_values(noise)
 
-    def create_dm_grid(self, dm_min, dm_max, dm_delta=None):
+    def create_dm_grid(self, dm_min, dm_max, dm_delta=None, pulse_width=0.,
+                       tolerance=1.25):
         """
         Method that create DM-grid for current frame.
 
@@ -342,16 +691,53 @@ class DynSpectra(object):
         :param dm_max:
             Maximum value [cm^3 /pc].
         :param dm_delta: (optional)
-            Delta of DM for grid [cm^3/pc]. If ``None`` then choose one that
-            corresponds to time shift equals to time resolution for frequency
-            bandwidth. Actually used value is 5 times larger.
-            (default: ``None``)
+            Delta of DM for uniform grid [cm^3/pc]. If ``None`` then create
+            non-uniform grid with minimal number of values for given
+            ``pulse_width`` and ``tolerance``. (default: ``None``)
+        :param pulse_width: (optional)
+            Intrinsic width of pulse [s]. (default: ``0.``)
+        :param tolerance: (optional)
+            Maximum ratio of effective width of pulse (that includes sampling
+            time, dispersion smearing in channel and smearing due to error of
+            DM) between neighbouring values of DM. SNR of pulse in the middle
+            between values of DM drops at most ``1 / sqrt(tolerance)`` times.
+            (default: ``1.25``)
         :return:
             Numpy array of DM values [cm^3 / pc]
-        """
-        raise NotImplementedError
 
-    def grid_dedisperse(self, dm_grid, threads=1):
+        :note:
+            Non-uniform grid follows Cordes & McLaughlin (2003) and Barsdell et
+            al. (2012) (``dedisp`` library). It is finer at low DM, where
+            sampling time dominates effective width of pulse, and coarser at
+            high DM, where dispersion smearing in channel dominates.
+        """
+        if dm_delta is not None:
+            return np.arange(dm_min, dm_max, dm_delta)
+        if not tolerance > 1.:
+            raise ValueError("Tolerance must be greater than 1, got"
+                             " {}".format(tolerance))
+
+        nu_c = np.mean(self.nu)
+        tol2 = tolerance ** 2.
+        # Smearing in channel for unit DM [s]
+        a2 = channel_smearing(nu_c, self.d_nu, 1.) ** 2.
+        # Smearing across band for unit error of DM [s]
+        b2 = a2 * self.n_nu ** 2. / 16.
+        c = (self.d_t.sec ** 2. + pulse_width ** 2.) * (tol2 - 1.)
+        dm_grid = [dm_min]
+        while True:
+            prev = dm_grid[-1]
+            prev2 = prev ** 2.
+            dm = (b2 * prev + np.sqrt(-a2 * b2 * prev2 +
+                                      (a2 + b2) * (c + tol2 * a2 * prev2))) /\
+                 (a2 + b2)
+            assert dm > prev
+            if dm >= dm_max:
+                break
+            dm_grid.append(dm)
+        return np.array(dm_grid)
+
+    def grid_dedisperse(self, dm_grid, threads=1, out=None):
         """
         Method that de-disperse ``DynSpectra`` instance with range values of
         dispersion measures and average them in frequency to obtain image in
@@ -361,31 +747,31 @@ class DynSpectra(object):
             Array-like of value of DM on which to de-disperse [cm^3/pc].
         :param threads: (optional)
             Number of threads used for parallelization with ``multiprocessing``
-            module. If > 1 then it isn't used. (default: 1)
+            module. If ``1`` then it isn't used. Worker processes are started
+            once and reused by all subsequent calls (see
+            ``dedispersion.DedispersionPool``). (default: 1)
+        :param out: (optional)
+            Out-of-core array (#DM, #t) (e.g. ``numpy.memmap`` or
+            ``h5py.Dataset``) to write result in. It is written by blocks of
+            DM values in one process, so whole result is never kept in
+            memory. If ``None`` then return numpy array. (default: ``None``)
 
         """
-        pool = None
+        plan = get_plan(self.nu, self.d_t.sec, dm_grid)
+        if out is not None:
+            return plan.dedisperse_to(self.values, out, weights=self.weights,
+                                      sample_weights=self.sample_weights,
+                                      scale=1. / self.n_nu_eff)
         if threads > 1:
-            pool = multiprocessing.Pool(threads, maxtasksperchild=1000)
-
-        if pool:
-            m = pool.map
+            frames = get_pool(threads).dedisperse(
+                self.values, plan, weights=self.weights,
+                sample_weights=self.sample_weights)
         else:
-            m = map
-
-        # Accumulator of de-dispersed frequency averaged frames
-        frames = list(m(self._de_disperse_by_value_freq_average,
-                        dm_grid.tolist()))
-        frames = np.array(frames)
+            frames = plan.dedisperse(self.values, weights=self.weights,
+                                     sample_weights=self.sample_weights)
+        return frames / self.n_nu_eff
 
-        if pool:
-            # Close pool
-            pool.close()
-            pool.join()
-
-        return frames
-
-    def save_to_hdf5(self, fname, name='dsp'):
+    def save_to_hdf5(self, fname, name='dsp', compression='gzip'):
         """
         Save data to HDF5 format.
 
@@ -393,6 +779,10 @@ class DynSpectra(object):
             File to save data.
         :param name: (optional)
             Name of dataset to use. (default: ``dsp``)
+        :param compression: (optional)
+            Compression filter of dataset. If ``None`` then dataset is stored
+            contiguously and ``create_from_hdf5`` memory-maps it. (default:
+            ``gzip``)
 
         :note:
             HDF5 hasn't time formats. Using ``str(datetime)`` to create strings
@@ -400,8 +790,11 @@ class DynSpectra(object):
         """
         import h5py
         f = h5py.File(fname, "w")
-        dset = f.create_dataset(name, data=self.values, chunks=True,
-                                compression='gzip')
+        dset = f.create_dataset(name, shape=self.values.shape,
+                                dtype=np.float32,
+                                chunks=compression is not None or None,
+                                compression=compression)
+        read_into(self.values, dset)
         meta_data = self.meta_data.copy()
         meta_data.update({'n_nu': self.n_nu, 'n_t': self.n_t, 'nu_0': self.nu_0,
                           'd_nu': self.d_nu, 'd_t': self.d_t.sec,
@@ -412,7 +805,200 @@ class DynSpectra(object):
         f.close()
 
 
-def create_from_hdf5(fname, name='dsp', n_nu_discard=0):
+class _StokesI(object):
+    """
+    Array-like (#ch, #t,) of averages of polarizations of cube (pol, band,
+    nu, t). Averages are calculated only for indexed rows and columns, so
+    de-dispersion (see ``storage.read_into``) reads them directly to its
+    working array. In-place addition adds to all polarizations.
+    """
+    backend = 'cube'
+
+    def __init__(self, cube):
+        n_pol, n_band, n_nu, n_t = cube.shape
+        # View (pol, band * nu, t)
+        self._pols = cube.reshape((n_pol, n_band * n_nu, n_t))
+        self.shape = self._pols.shape[1:]
+        self.dtype = cube.dtype
+        self.ndim = 2
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        return self._pols[(slice(None),) + key].mean(axis=0,
+                                                     dtype=self.dtype)
+
+    def __array__(self, dtype=None):
+        return np.asarray(self[:], dtype=dtype)
+
+    def __iadd__(self, other):
+        self._pols += np.asarray(other, dtype=self.dtype)
+        return self
+
+    def add_at(self, index, values):
+        """
+        Add values to all polarizations (see ``numpy.add.at``).
+        """
+        for pol in self._pols:
+            np.add.at(pol, index, values)
+
+
+class DynSpectraCube(DynSpectra):
+    """
+    Dynamical spectra of several polarizations and bands held in one shared
+    memory cube (pol, band, nu, t). Values (``values``) are Stokes I (average
+    of polarizations) with bands in order of increasing frequency. They are
+    calculated lazily, only for accessed time steps and channels. Adding to
+    values (e.g. ``add_pulse``) adds to all polarizations.
+
+    :param n_pol:
+        Number of polarizations.
+    :param n_band:
+        Number of bands.
+    :param n_nu:
+        Number of spectral channels in each band.
+    :param n_t:
+        Number of time steps.
+    :param nu_0:
+        Frequency of highest frequency channel of the highest band [MHz].
+    :param d_nu:
+        Width of spectral channel [MHz].
+    :param d_t:
+        Time step [s].
+    :param meta_data:
+        Dictionary with metadata (see ``DynSpectra``).
+    :param t_0: (optional)
+        Time of first measurement. Instance of ``astropy.time.Time`` class. If
+        ``None`` then use time of initialization. (default: ``None``)
+    :param cube: (optional)
+        Array (pol, band, nu, t) to use without copying. Channels of each band
+        must be in order of increasing frequency. If ``None`` then create
+        array of zeros in shared memory. (default: ``None``)
+
+    """
+    def __init__(self, n_pol, n_band, n_nu, n_t, nu_0, d_nu, d_t,
+                 meta_data=None, t_0=None, cube=None):
+        if cube is None:
+            cube = create_storage(n_pol * n_band * n_nu, n_t)
+            cube = cube.reshape((n_pol, n_band, n_nu, n_t))
+        assert cube.shape == (n_pol, n_band, n_nu, n_t)
+        self.cube = cube
+        self.n_pol = n_pol
+        self.n_band = n_band
+        super(DynSpectraCube, self).__init__(n_band * n_nu, n_t, nu_0, d_nu,
+                                             d_t, meta_data=meta_data,
+                                             t_0=t_0, values=_StokesI(cube))
+
+    def __repr__(self):
+        outprint = "# polarizations: {}\n".format(self.n_pol)
+        outprint += "# bands: {}\n".format(self.n_band)
+        return outprint + super(DynSpectraCube, self).__repr__()
+
+    def add_values(self, array):
+        """
+        Add dyn. spectra (#ch, #t,) to all polarizations.
+        """
+        array = np.atleast_2d(array)
+        assert tuple(self.values.shape) == array.shape
+        self.values += array
+
+    def add_noise(self, std):
+        """
+        Add independent rayleigh-distributed noise to each polarization, so
+        it averages down in Stokes I as noise of receivers does.
+
+        :param std:
+            Std of rayleigh-distributed uncorrelated noise.
+        """
+        self._check_writeable()
+        self.cube += np.random.rayleigh(std, size=self.cube.shape).astype(
+            self.cube.dtype)
+
+    def pol(self, i):
+        """
+        Dynamical spectra of one polarization (all bands) without copying.
+
+        :param i:
+            Index of polarization.
+
+        :return:
+            Instance of ``DynSpectra`` class.
+        """
+        meta_data = self.meta_data.copy()
+        if len(meta_data['pol']) == self.n_pol:
+            meta_data['pol'] = meta_data['pol'][i]
+        values = self.cube[i].reshape((self.n_nu, self.n_t))
+        dsp = DynSpectra(self.n_nu, self.n_t, self.nu_0, self.d_nu,
+                         self.d_t.sec, meta_data=meta_data, t_0=self.t_0,
+                         values=values)
+        self._copy_weights(dsp, slice(None))
+        return dsp
+
+    def band(self, j, pol=None):
+        """
+        Dynamical spectra of one band without copying.
+
+        :param j:
+            Index of band (bands are in order of increasing frequency).
+        :param pol: (optional)
+            Index of polarization. If ``None`` then return cube with Stokes I
+            of band. (default: ``None``)
+
+        :return:
+            Instance of ``DynSpectra`` (or ``DynSpectraCube``) class.
+        """
+        n_nu = self.n_nu // self.n_band
+        nu_0 = self.nu_0 - (self.n_band - 1 - j) * n_nu * self.d_nu
+        channels = slice(j * n_nu, (j + 1) * n_nu)
+        meta_data = self.meta_data.copy()
+        # Bands of cube are in order of increasing frequency (``L`` first)
+        bands = sorted(set(meta_data['band']))
+        if len(bands) == self.n_band:
+            meta_data['band'] = bands[j]
+        if pol is None:
+            dsp = DynSpectraCube(self.n_pol, 1, n_nu, self.n_t, nu_0,
+                                 self.d_nu, self.d_t.sec,
+                                 meta_data=meta_data, t_0=self.t_0,
+                                 cube=self.cube[:, j: j + 1])
+        else:
+            if len(meta_data['pol']) == self.n_pol:
+                meta_data['pol'] = meta_data['pol'][pol]
+            dsp = DynSpectra(n_nu, self.n_t, nu_0, self.d_nu, self.d_t.sec,
+                             meta_data=meta_data, t_0=self.t_0,
+                             values=self.cube[pol, j])
+        self._copy_weights(dsp, channels)
+        return dsp
+
+    def view(self, start=None, stop=None):
+        """
+        Select time steps without copying data (see ``DynSpectra.view``).
+
+        :return:
+            Instance of ``DynSpectraCube`` class.
+        """
+        start, stop, _ = slice(start, stop).indices(self.n_t)
+        stop = max(start, stop)
+        frame = DynSpectraCube(self.n_pol, self.n_band,
+                               self.n_nu // self.n_band, stop - start,
+                               self.nu_0, self.d_nu, self.d_t.sec,
+                               meta_data=self.meta_data,
+                               t_0=self.t_0 + start * self.d_t,
+                               cube=self.cube[..., start: stop])
+        frame.weights = self.weights.copy()
+        if self.sample_weights is not None:
+            frame.sample_weights = self.sample_weights[:, start: stop]
+        return frame
+
+    def _copy_weights(self, dsp, channels):
+        dsp.weights = self.weights[channels].copy()
+        if self.sample_weights is not None:
+            dsp.sample_weights = self.sample_weights[channels]
+
+
+def create_from_hdf5(fname, name='dsp', n_nu_discard=0, backend=None):
     """
     Function that creates instance of ``DynSpectra`` class from HDF5-file.
 
@@ -425,25 +1011,55 @@ def create_from_hdf5(fname, name='dsp', n_nu_discard=0):
     :param n_nu_discard: (optional)
         NUmber of spectral channels to discard symmetrically from both low and
          high frequency.
+    :param backend: (optional)
+        If ``None`` then contiguous uncompressed dataset is memory-mapped
+        copy-on-write (``memmap`` backend, values could be changed but file
+        stays intact) and other ones are read to memory (``numpy`` backend).
+        If ``hdf5`` then values are read-only and aren't read to memory:
+        contiguous uncompressed dataset is memory-mapped (``memmap`` backend)
+        and other ones are read on demand (``hdf5`` backend, if channels are
+        discarded then selected rows are read to memory). If ``shared`` or
+        ``numpy`` then values are read to memory. HDF5-file is closed when
+        values are read to memory. (default: ``None``)
 
     :return:
         Instance of ``DynSpectra`` class.
     """
-    data, meta_data = read_hdf5(fname, name)
+    assert not int(n_nu_discard) % 2
+    data, meta_data = open_hdf5(fname, name,
+                                mode='r' if backend == 'hdf5' else 'c')
     n_nu = meta_data.pop('n_nu')
     n_t = meta_data.pop('n_t')
     nu_0 = meta_data.pop('nu_0')
     d_nu = meta_data.pop('d_nu')
     d_t = meta_data.pop('d_t')
     t_0 = Time(meta_data.pop('t_0'))
-    dsp = DynSpectra(n_nu - n_nu_discard, n_t, nu_0 - n_nu_discard * d_nu / 2.,
-                     d_nu, d_t, meta_data, t_0=t_0)
-    dsp.add_values(data)
+    start = n_nu_discard / 2
+    if backend in (None, 'hdf5'):
+        if is_in_memory(data):
+            # View of memory-mapped rows
+            data = data[start: n_nu - start]
+            backend = None
+        elif backend is None or n_nu_discard:
+            backend = 'numpy'
+        else:
+            backend = None
+    if backend is None:
+        dsp = DynSpectra(n_nu - n_nu_discard, n_t,
+                         nu_0 - n_nu_discard * d_nu / 2., d_nu, d_t,
+                         meta_data, t_0=t_0, values=data)
+    else:
+        dsp = DynSpectra(n_nu - n_nu_discard, n_t,
+                         nu_0 - n_nu_discard * d_nu / 2., d_nu, d_t,
+                         meta_data, t_0=t_0, backend=backend)
+        read_into(data, dsp.values, start=start)
+        if not is_in_memory(data):
+            data.file.close()
     return dsp
 
 
 def create_from_txt(fname, nu_0, d_nu, d_t, meta_data, t_0=None,
-                    n_nu_discard=0):
+                    n_nu_discard=0, backend='shared', n_nu=None):
     """
     Function that creates instance of ``DynSpectra`` class from text file.
 
@@ -466,22 +1082,41 @@ def create_from_txt(fname, nu_0, d_nu, d_t, meta_data, t_0=None,
     :param n_nu_discard: (optional)
         NUmber of spectral channels to discard symmetrically from both low and
          high frequency.
+    :param backend: (optional)
+        Storage of values (see ``DynSpectra``). If ``memmap`` then ``.npy``
+        or binary file is memory-mapped without copying. (default:
+        ``shared``)
+    :param n_nu: (optional)
+        Number of spectral channels of binary ``float32`` file (``-b``
+        option of ``my5spec``). If ``None`` then file is ``.npy`` or text.
+        (default: ``None``)
 
     :return:
         Instance of ``DynSpectra`` class.
     """
     assert not int(n_nu_discard) % 2
 
-    try:
-        values = np.load(fname).T
-    except IOError:
-        values = np.loadtxt(fname, unpack=True)
+    mmap_mode = 'r' if backend == 'memmap' else None
+    if n_nu is not None:
+        values = np.memmap(fname, dtype='<f4', mode='r').reshape((-1,
+                                                                  n_nu)).T
+    else:
+        try:
+            values = np.load(fname, mmap_mode=mmap_mode).T
+        except IOError:
+            values = np.loadtxt(fname, unpack=True)
+            mmap_mode = None
     n_nu, n_t = np.shape(values)
-    dsp = DynSpectra(n_nu - n_nu_discard, n_t, nu_0 - n_nu_discard * d_nu / 2.,
-                     d_nu, d_t, meta_data=meta_data, t_0=t_0)
     if n_nu_discard:
-        dsp.values += values[n_nu_discard / 2: -n_nu_discard / 2, :]
-    else:
-        dsp.values += values
+        values = values[n_nu_discard / 2: -n_nu_discard / 2, :]
+    if mmap_mode is not None:
+        return DynSpectra(n_nu - n_nu_discard, n_t,
+                          nu_0 - n_nu_discard * d_nu / 2., d_nu, d_t,
+                          meta_data=meta_data, t_0=t_0, values=values)
+    if backend == 'memmap':
+        backend = 'numpy'
+    dsp = DynSpectra(n_nu - n_nu_discard, n_t, nu_0 - n_nu_discard * d_nu / 2.,
+                     d_nu, d_t, meta_data=meta_data, t_0=t_0, backend=backend)
+    dsp.values += values
 
     return dsp
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 import numpy as np
 from search_candidates import Searcher
-from search import get_ellipse_features_for_classification, max_pos
+from search import (get_ellipse_features_for_classification, max_pos,
+                    dm_from_index)
 from sklearn.svm import SVC
 from sklearn.ensemble import GradientBoostingClassifier
 from sklearn.cross_validation import StratifiedShuffleSplit
@@ -53,7 +54,7 @@ class PulseClassifier(object):
         for pars in zip(t0s, amps, widths, dms):
             print "Adding pulse with t0={:.3f}, amp={:.2f}, width={:.4f}," \
                   " DM={:.0f}".format(*pars)
-            dsp.add_pulse(*pars)
+        dsp.add_pulses(zip(t0s, amps, widths, dms))
         searcher = Searcher(dsp)
         searcher.de_disperse(self.de_disp_func, *self.de_disp_args,
                              **self.de_disp_kwargs)
@@ -68,7 +69,6 @@ class PulseClassifier(object):
         debug = list()
         # FIXME: This assumes that only one positional argument is dm array.
         dm_range = self.de_disp_args[0]
-        dm_delta = dm_range[1] - dm_range[0]
         for (t0_, dm_,) in zip(t0s, dms):
             print "Finding injected pulse t0={:.3f}," \
                   " DM={:.0f}".format(t0_, dm_)
@@ -79,7 +79,7 @@ class PulseClassifier(object):
                 # print "max_pos, dt, dm for prop: ", max_pos_, _d_dt, _d_dm
                 dm__, t_ = max_pos_
                 t_ *= dsp.d_t.sec
-                dm__ *= dm_delta
+                dm__ = dm_from_index(dm__, dm_range)
                 prop.t0 = t_
                 prop.dm0 = dm__
                 prop.dt = _d_dt
@@ -103,13 +103,15 @@ class PulseClassifier(object):
                 remove_pulses.append([t0_, dm_])
 
         # Now remove pulses that can't be found
+        rm_table = list()
         for (t0_, dm_) in remove_pulses:
             for pars in zip(t0s, amps, widths, dms):
                 t0__, _, _, dm__ = pars
                 if t0_ == t0__ and dm_ == dm__:
                     print "Removing pulse with t0={:.3f}, amp={:.2f}," \
                           " width={:.4f}, dm={:.0f}".format(*pars)
-                    dsp.rm_pulse(*pars)
+                    rm_table.append(pars)
+        dsp.rm_pulses(rm_table)
 
         # Again find props now without pulses that can't be found
         searcher.reset_dedispersion()
@@ -138,7 +140,7 @@ class PulseClassifier(object):
                                                  searcher._de_dispersed_data)
                 dm__, t_ = max_pos_
                 t_ *= dsp.d_t.sec
-                dm__ *= dm_delta
+                dm__ = dm_from_index(dm__, dm_range)
                 prop.t0 = t_
                 prop.dm0 = dm__
                 prop.dt = _d_dt
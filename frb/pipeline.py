@@ -3,9 +3,9 @@ import os
 import numpy as np
 from astropy.time import TimeDelta
 from collections import defaultdict
-from dyn_spectra import DynSpectra
+from dyn_spectra import DynSpectraCube
 from cfx import CFX
-from raw_data import M5, dspec_cat
+from raw_data import M5, read_dspec_cube
 from queries import connect_to_db, query_frb
 from search_candidates import Searcher
 from dedispersion import noncoherent_dedisperse
@@ -48,9 +48,9 @@ class SearchExperiment(object):
         """
         return self.cfx.parse_cfx(self.exp_code)
 
-    def dsp_generator(self, m5_file, m5_params, chunk_size):
+    def dsp_generator(self, m5_file, m5_params, chunk_size, binary=False):
         """
-        Generator that returns instances of ``DynSpectra`` class.
+        Generator that returns instances of ``DynSpectraCube`` class.
 
         :param m5_file:
             Raw data file in M5 format.
@@ -58,9 +58,15 @@ class SearchExperiment(object):
             Dictionary with meta data.
         :param chunk_size:
             Size (in s) of chunks to process raw data.
+        :param binary: (optional)
+            Boolean. If ``True`` then ``my5spec`` writes raw ``float32``
+            spectra (``-b`` option), that are read without text parsing. It
+            needs ``my5spec`` built with ``-b`` support. If ``False`` then
+            spectra are written and read as text. (default: ``False``)
         """
         dsp_params = self.dsp_params
-        dsp_params.update({'offset': 0., 'outfile': None, 'dur': chunk_size})
+        dsp_params.update({'offset': 0., 'outfile': None, 'dur': chunk_size,
+                           'binary': binary})
         m5file_fmt = m5_params['m5_fmt']
         cfx_fmt = m5_params['cfx_fmt']
         m5 = M5(m5_file, m5file_fmt)
@@ -70,9 +76,10 @@ class SearchExperiment(object):
             dsp_params.update({'offset': offset})
             ds = m5.create_dspec(**dsp_params)
 
-            # NOTE: all 4 channels are stacked forming dsarr:
-            dsarr = dspec_cat(os.path.basename(ds['Dspec_file']),
-                              cfx_fmt)
+            # NOTE: all 4 channels are kept in cube (pol, band, nu, t)
+            cube = read_dspec_cube(os.path.basename(ds['Dspec_file']),
+                                   cfx_fmt,
+                                   n_nu=dsp_params['n_nu'] if binary else None)
             metadata = ds
             t_0 = m5.start_time + TimeDelta(offset, format='sec')
             print "t_0 : ", t_0.datetime
@@ -83,12 +90,10 @@ class SearchExperiment(object):
                              'band': "".join(m5_params['band']),
                              'pol': "".join(m5_params['pol']),
                              'exp_code': m5_params['exp_code']})
-            # FIXME: ``2`` means combining U&L bands.
-            dsp = DynSpectra(2 * dsp_params['n_nu'], dsarr.shape[0],
-                             dsp_params['nu_0'], dsp_params['d_nu'],
-                             0.001 * dsp_params['d_t'], meta_data=metadata,
-                             t_0=t_0)
-            dsp.add_values(dsarr.T)
+            n_pol, n_band, n_nu, n_t = cube.shape
+            dsp = DynSpectraCube(n_pol, n_band, n_nu, n_t, dsp_params['nu_0'],
+                                 dsp_params['d_nu'], 0.001 * dsp_params['d_t'],
+                                 meta_data=metadata, t_0=t_0, cube=cube)
             offset += chunk_size
 
             yield dsp
@@ -98,7 +103,7 @@ class SearchExperiment(object):
     # before.
     def run(self, de_disp_params, pre_process_params, search_params,
             antenna=None, except_antennas=None, cache_dir=None,
-            chunk_size=100):
+            chunk_size=100, binary=False):
         """
         Run pipeline on experiment.
 
@@ -119,6 +124,9 @@ class SearchExperiment(object):
             (default: ``None``)
         :param chunk_size: (optional)
             Size (in s) of chunks to process raw data. (default: ``100.``)
+        :param binary: (optional)
+            Boolean. Read binary output of ``my5spec`` instead of text (see
+            ``dsp_generator``). (default: ``False``)
 
         :note:
             Argument dictionaries should have keys: 'func', 'args', 'kwargs'
@@ -136,7 +144,7 @@ class SearchExperiment(object):
             if except_antennas and m5_antenna in except_antennas:
                 continue
             dsp_gen = self.dsp_generator(m5_file, m5_params,
-                                         chunk_size=chunk_size)
+                                         chunk_size=chunk_size, binary=binary)
             for dsp in dsp_gen:
                 searcher = Searcher(dsp, cache_dir=cache_dir)
                 candidates = searcher.run(de_disp_params['func'],
@@ -2,11 +2,12 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import (aliased, sessionmaker)
 from sqlalchemy.sql import func
-from candidates import (Candidate, SearchedData)
+from candidates import (Candidate, SearchedData, upgrade_db)
 
 
 def connect_to_db(db_file):
     engine = create_engine("sqlite:///{}".format(db_file))
+    upgrade_db(engine)
     Session = sessionmaker(bind=engine)
     session = Session()
     return session
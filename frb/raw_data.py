@@ -11,11 +11,44 @@ import matplotlib.pyplot as plt
 import subprocess
 import time
 import re
-from astropy.time import Time
+from multiprocessing.pool import ThreadPool
+from astropy.time import Time, TimeDelta
+from dedispersion import coherent_dedisperse, k
+from storage import create_storage
 
 
 my5spec = "../my5spec/./my5spec"
 
+# Mark5B frame: 16 bytes header (starting with sync word) & 10000 bytes of data
+mark5b_header_size = 16
+mark5b_payload_size = 10000
+mark5b_frame_size = mark5b_header_size + mark5b_payload_size
+mark5b_sync_word = '\xed\xde\xad\xab'
+# Optimal levels of 2-bit samples (sign/magnitude) as in ``mark5access``
+mark5b_levels_2bit = np.array([-3.3359, 1.0, -1.0, 3.3359], dtype=np.float32)
+# Values of four 2-bit samples packed in each possible byte (256, 4)
+_lut_2bit = mark5b_levels_2bit[(np.arange(256)[:, np.newaxis] >>
+                                 (2 * np.arange(4))) & 3]
+
+
+def decode_mark5b(payload, n_chan, n_bit=2):
+    """
+    Decode data of Mark5B frames.
+
+    :param payload:
+        1D numpy array of ``uint8`` with data of frames (without headers).
+    :param n_chan:
+        Number of channels.
+    :param n_bit: (optional)
+        Number of bits per sample. Only ``2`` is supported. (default: ``2``)
+
+    :return:
+        2D numpy array (#samples, #channels) of ``float32`` voltages.
+    """
+    if n_bit != 2:
+        raise Exception("Only 2-bit Mark5B data could be decoded")
+    return _lut_2bit[payload].reshape((-1, n_chan))
+
 
 class M5(object):
     """ working with raw data """
@@ -44,6 +77,148 @@ class M5(object):
         res = m5_mjd + m5_time
         return Time(res, format='mjd')
 
+    @property
+    def _fmt_params(self):
+        """
+        Total bit rate [Mbps], number of channels and bits per sample.
+        """
+        res = re.match('Mark5B-(\d+)-(\d+)-(\d+)', self.fmt)
+        if res is None:
+            raise Exception("Only Mark5B format could be read, got"
+                            " {}".format(self.fmt))
+        return [int(x) for x in res.groups()]
+
+    @property
+    def n_chan(self):
+        return self._fmt_params[1]
+
+    @property
+    def sample_rate(self):
+        """
+        Number of samples per second in each channel.
+        """
+        rate, n_chan, n_bit = self._fmt_params
+        return rate * 1e6 / (n_chan * n_bit)
+
+    @property
+    def bandwidth(self):
+        """
+        Bandwidth of each channel [MHz].
+        """
+        return self.sample_rate / 2e6
+
+    @property
+    def _samples_per_frame(self):
+        rate, n_chan, n_bit = self._fmt_params
+        return 8 * mark5b_payload_size // (n_chan * n_bit)
+
+    @property
+    def _first_frame_offset(self):
+        """
+        Offset [bytes] of the first complete frame in file.
+        """
+        with open(self.m5file, 'rb') as fo:
+            data = fo.read(2 * mark5b_frame_size)
+        offset = data.find(mark5b_sync_word)
+        if offset < 0:
+            raise Exception("Can't find Mark5B sync word in {}".format(
+                self.m5file))
+        return offset
+
+    def read_voltages(self, t_start, duration):
+        """
+        Read and decode voltages of all channels.
+
+        :param t_start:
+            Time of the first sample. Instance of ``astropy.time.Time`` or
+            offset from the start of file [s].
+        :param duration:
+            Duration [s].
+
+        :return:
+            2D numpy array (#samples, #channels) of ``float32`` voltages.
+        """
+        if isinstance(t_start, Time):
+            t_start = (t_start - self.starttime).sec
+        sample_rate = self.sample_rate
+        i_start = int(round(t_start * sample_rate))
+        n_samples = int(round(duration * sample_rate))
+        if i_start < 0:
+            raise Exception("Start time is before the start of file")
+        spf = self._samples_per_frame
+        frame_start = i_start // spf
+        n_frames = (i_start + n_samples - 1) // spf - frame_start + 1
+        with open(self.m5file, 'rb') as fo:
+            fo.seek(self._first_frame_offset +
+                    frame_start * mark5b_frame_size)
+            frames = np.fromfile(fo, dtype=np.uint8,
+                                 count=n_frames * mark5b_frame_size)
+        if frames.size < n_frames * mark5b_frame_size:
+            raise Exception("End time is after the end of file")
+        frames = frames.reshape((n_frames, mark5b_frame_size))
+        rate, n_chan, n_bit = self._fmt_params
+        voltages = decode_mark5b(frames[:, mark5b_header_size:].ravel(),
+                                 n_chan, n_bit)
+        i_start -= frame_start * spf
+        return voltages[i_start: i_start + n_samples]
+
+    def coherent_profile(self, candidate, cfx_fmt, duration=0.02, d_t=1e-5):
+        """
+        Coherently de-disperse voltages around candidate and return
+        de-dispersed profile with high time resolution.
+
+        :param candidate:
+            Instance of ``Candidate`` class (or any object with ``t`` -
+            ``datetime`` of pulse at the highest frequency of band and ``dm``
+            attributes).
+        :param cfx_fmt:
+            Iterable of strings with ``frequency-polarization-sideband`` of
+            channels (e.g. ``['4828.00-L-U', '4828.00-R-U', '4828.00-L-L',
+            '4828.00-R-L']``). Frequency is the reference (LO) frequency of
+            channel [MHz].
+        :param duration: (optional)
+            Duration of profile centered on candidate [s]. (default:
+            ``0.02``)
+        :param d_t: (optional)
+            Time resolution of profile [s]. (default: ``1e-5``)
+
+        :return:
+            Numpy array of profile - power of voltages, normalized by mean
+            power of each channel and summed over channels. First value
+            corresponds to ``candidate.t - duration / 2``.
+        """
+        dm = candidate.dm
+        t = Time(candidate.t, scale='utc')
+        bandwidth = self.bandwidth
+        channels = [fmt.split('-') for fmt in cfx_fmt]
+        nu_refs = np.array([float(nu) for nu, _, _ in channels])
+        sidebands = [sb for _, _, sb in channels]
+        nu_max = max(nu + bandwidth if sb == 'U' else nu for nu, sb in
+                     zip(nu_refs, sidebands))
+        # Arrival time at reference frequencies of channels relative to the
+        # highest frequency of band & delay across channel [s]
+        offsets = k * dm * (1. / nu_refs ** 2. - 1. / nu_max ** 2.)
+        span = k * dm * (1. / (nu_refs.min() - bandwidth) ** 2. -
+                         1. / nu_refs.min() ** 2.)
+        t_read = (offsets.min() - span - duration / 2.)
+        voltages = self.read_voltages(t + TimeDelta(t_read, format='sec'),
+                                      offsets.max() - offsets.min() +
+                                      2. * span + duration)
+
+        n_bin = int(round(d_t * self.sample_rate))
+        n_profile = int(round(duration / d_t))
+        profile = np.zeros(n_profile)
+        for i, (nu_ref, sb) in enumerate(zip(nu_refs, sidebands)):
+            dedispersed = coherent_dedisperse(voltages[:, i], nu_ref,
+                                              bandwidth, dm, sideband=sb)
+            power = dedispersed ** 2.
+            start = int(round((offsets[i] - offsets.min() + span) *
+                              self.sample_rate))
+            power = power[start: start + n_profile * n_bin]
+            power = power.reshape((n_profile, n_bin)).mean(axis=1)
+            profile += power / np.mean(power)
+        return profile
+
     def __repr__(self):
         """ Show some info about the m5file """
         outprint = "File: %s\n" % self.m5file
@@ -69,10 +244,12 @@ class M5(object):
         os.remove(tmpfile)
 
     def create_dspec(self, n_nu=64, d_t=1, offset=0, dur=None, outfile=None,
-                     dspec_path=None, **kwargs):
+                     dspec_path=None, binary=False, **kwargs):
         """
         Create 4 DS files for selected M5datafile with nchan, dt[ms], ...
-        The input options are the same as for my5spec
+        The input options are the same as for my5spec. If ``binary`` is
+        ``True`` then files are written as raw ``float32`` (``-b`` option, see
+        ``read_dspec_file``).
         """
         if dspec_path is None:
             dspec_path = os.getcwd()
@@ -92,6 +269,8 @@ class M5(object):
             opt4 = ""
 
         opts = opt1 + opt2 + opt3 + opt4
+        if binary:
+            opts += "-b "
 
         if not outfile:
             opts2 = re.sub("-", "", "".join(opts.split()))
@@ -112,15 +291,10 @@ def get_cfx_format(fname, cfx_data):
     return cfx_data[fname][-1]
 
 
-def dspec_cat(fname, cfx_fmt, pol=True, uplow=True, dspec_path=None):
+def _find_dspec_files(fname, cfx_fmt, dspec_path=None):
     """
-    Concatenate dynamical spectra files, returning array.
-    INPUTS:
-    fname - base filename pattern of DS-files\n
-    cfx_format - ['4828.00-L-U', '4828.00-R-U', '4828.00-L-L', '4828.00-R-L']\n
-    pol - sum polarizations\n
-    uplow - concat UPPER and LOWER bands\n
-    OUTPUT: np.array
+    Find files with dynamical spectra created by ``my5spec`` for each item of
+    CFX-format.
     """
     if dspec_path is None:
         dspec_path = os.getcwd()
@@ -132,12 +306,114 @@ def dspec_cat(fname, cfx_fmt, pol=True, uplow=True, dspec_path=None):
         raise Exception("WARNING! dspec_cat: There are difference in files"
                         " number and CFX-format length")
     # FIXME: improve the above checkings
-    flist = sorted(flist, key=lambda x: int(x[-2:]))
-    ashape = np.loadtxt(flist[0]).shape
-    arr = np.zeros((ashape[0], ashape[1]*2))
-    for fmt, fil in zip(cfx_fmt, flist):
-        if fmt.split('-')[2] == 'L':
-            arr[:, :ashape[1]] = arr[:, :ashape[1]] + np.loadtxt(fil)[:, ::-1]
-        else:
-            arr[:, ashape[1]:] = arr[:, ashape[1]:] + np.loadtxt(fil)
-    return arr/2
+    return sorted(flist, key=lambda x: int(x[-2:]))
+
+
+def cube_layout(cfx_fmt):
+    """
+    Polarizations and bands of CFX-format.
+
+    :param cfx_fmt:
+        Iterable of CFX-format items, e.g. ``['4828.00-L-U', '4828.00-R-U',
+        '4828.00-L-L', '4828.00-R-L']``.
+
+    :return:
+        Lists of polarizations (in order of appearance) and bands (lower
+        band first).
+    """
+    pols = list()
+    bands = list()
+    for fmt in cfx_fmt:
+        _, pol, band = fmt.split('-')
+        if pol not in pols:
+            pols.append(pol)
+        if band not in bands:
+            bands.append(band)
+    return pols, sorted(bands)
+
+
+def read_dspec_file(fname, n_nu=None):
+    """
+    Read dynamical spectra file created by ``my5spec``.
+
+    :param fname:
+        DS-file.
+    :param n_nu: (optional)
+        Number of spectral channels of binary file (``-b`` option of
+        ``my5spec``). If ``None`` then file is text. (default: ``None``)
+
+    :return:
+        Numpy array (#t, #ch,). Binary file is memory-mapped (read-only).
+    """
+    if n_nu is None:
+        return np.loadtxt(fname, ndmin=2)
+    n_t = os.path.getsize(fname) // (4 * n_nu)
+    return np.memmap(fname, dtype='<f4', mode='r', shape=(n_t, n_nu))
+
+
+def read_dspec_cube(fname, cfx_fmt, dspec_path=None, n_nu=None, threads=4):
+    """
+    Read dynamical spectra files created by ``my5spec`` to cube.
+
+    :param fname:
+        Base filename pattern of DS-files.
+    :param cfx_fmt:
+        Iterable of CFX-format items (see ``cube_layout``).
+    :param dspec_path: (optional)
+        Directory with DS-files. If ``None`` then use CWD. (default: ``None``)
+    :param n_nu: (optional)
+        Number of spectral channels of binary files. If ``None`` then files
+        are text. (default: ``None``)
+    :param threads: (optional)
+        Number of threads to read binary files concurrently. (default: ``4``)
+
+    :return:
+        Numpy array (pol, band, nu, t) in shared memory. Channels of lower
+        band are flipped, so all bands are in order of increasing frequency.
+
+    :note:
+        Binary files are memory-mapped and copied directly to cube, so there
+        are no intermediate arrays.
+    """
+    flist = _find_dspec_files(fname, cfx_fmt, dspec_path)
+    pols, bands = cube_layout(cfx_fmt)
+    datas = [read_dspec_file(flist[0], n_nu)] + [None] * (len(flist) - 1)
+    n_t, n_nu_ = datas[0].shape
+    cube = create_storage(len(pols) * len(bands) * n_nu_, n_t)
+    cube = cube.reshape((len(pols), len(bands), n_nu_, n_t))
+
+    def read(args):
+        fmt, fil, data = args
+        _, pol, band = fmt.split('-')
+        if data is None:
+            data = read_dspec_file(fil, n_nu)
+        if band == 'L':
+            data = data[:, ::-1]
+        cube[pols.index(pol), bands.index(band)] = data.T
+
+    tasks = zip(cfx_fmt, flist, datas)
+    if n_nu is None or threads == 1:
+        map(read, tasks)
+    else:
+        pool = ThreadPool(min(threads, len(tasks)))
+        pool.map(read, tasks)
+        pool.close()
+    return cube
+
+
+def dspec_cat(fname, cfx_fmt, pol=True, uplow=True, dspec_path=None,
+              n_nu=None):
+    """
+    Concatenate dynamical spectra files, returning array.
+    INPUTS:
+    fname - base filename pattern of DS-files\n
+    cfx_format - ['4828.00-L-U', '4828.00-R-U', '4828.00-L-L', '4828.00-R-L']\n
+    pol - sum polarizations\n
+    uplow - concat UPPER and LOWER bands\n
+    n_nu - number of channels of binary DS-files (None for text files)\n
+    OUTPUT: np.array of float32 (spectra are kept in single precision, so
+    relative precision of values is about 1e-7)
+    """
+    cube = read_dspec_cube(fname, cfx_fmt, dspec_path=dspec_path, n_nu=n_nu)
+    n_pol, n_band, n_nu, n_t = cube.shape
+    return cube.reshape((n_pol, n_band * n_nu, n_t)).mean(axis=0).T
@@ -7,6 +7,7 @@ from skimage.measure import regionprops
 from skimage.morphology import opening
 from skimage.transform import warp, AffineTransform
 from candidates import Candidate
+from dedispersion import MultiResolutionTDM
 from utils import find_clusters_ell_amplitudes
 from detect_peaks import detect_peaks
 from astropy.time import TimeDelta
@@ -20,6 +21,26 @@ class NoIntensityRegionException(Exception):
     pass
 
 
+def dm_from_index(indx, d_dm):
+    """
+    Convert (possibly fractional) index of row of TDM-array to value of DM.
+
+    :param indx:
+        Index of row or array of indexes.
+    :param d_dm:
+        Step of uniform DM grid that starts from zero [cm^3/pc] or array-like
+        of values of (possibly non-uniform) DM grid (see
+        ``DynSpectra.create_dm_grid``).
+
+    :return:
+        Value(s) of DM [cm^3/pc].
+    """
+    if np.ndim(d_dm) == 0:
+        return indx * float(d_dm)
+    d_dm = np.asarray(d_dm, dtype=float)
+    return np.interp(indx, np.arange(len(d_dm)), d_dm)
+
+
 def find_peaks(array_like, n_std=4, med_width=31, gauss_width=2):
     """
     Find peaks in 1D array.
@@ -84,6 +105,7 @@ def search_candidates_clf(image, pclf, t_0, d_t, d_dm, save_fig=False,
     :return:
         List of ``Candidate`` instances.
     """
+    image = np.asarray(image)
     out_features_dict, out_responses_dict = pclf.classify_data(image)
 
     # Select only positively classified regions
@@ -107,7 +129,7 @@ def search_candidates_clf(image, pclf, t_0, d_t, d_dm, save_fig=False,
 
         max_pos = (gg.x_mean + prop.bbox[0], gg.y_mean + prop.bbox[1])
         candidate = Candidate(t_0 + max_pos[1] * TimeDelta(d_t, format='sec'),
-                              max_pos[0] * float(d_dm))
+                              dm_from_index(max_pos[0], d_dm))
         candidates.append(candidate)
 
     return candidates
@@ -118,6 +140,7 @@ def search_candidates_clf(image, pclf, t_0, d_t, d_dm, save_fig=False,
 # the option to use original image (more variance - less bias)
 def search_candidates(image, n_d_x, n_d_y, t_0, d_t, d_dm):
 
+    image = np.asarray(image)
     a = image.copy()
     s = generate_binary_structure(2, 2)
     # Label image
@@ -152,7 +175,7 @@ def search_candidates(image, n_d_x, n_d_y, t_0, d_t, d_dm):
     for _object in _objects:
         max_pos = _object['max_pos']
         candidate = Candidate(t_0 + max_pos[1] * TimeDelta(d_t, format='sec'),
-                              max_pos[0] * float(d_dm))
+                              dm_from_index(max_pos[0], d_dm))
         candidates.append(candidate)
 
     return candidates
@@ -162,6 +185,7 @@ def search_candidates_ell(image, x_stddev, x_cos_theta,
                           y_to_x_stddev, theta_lims, t_0, d_t, d_dm,
                           save_fig=False, amplitude=None,
                           original_dsp=None):
+    image = np.asarray(image)
     a = image.copy()
     s = generate_binary_structure(2, 2)
     # Label image
@@ -218,7 +242,7 @@ def search_candidates_ell(image, x_stddev, x_cos_theta,
             max_pos = (gg.x_mean + prop.bbox[0], gg.y_mean + prop.bbox[1])
             candidate = Candidate(t_0 + max_pos[1] * TimeDelta(d_t,
                                                                format='sec'),
-                                  max_pos[0] * float(d_dm))
+                                  dm_from_index(max_pos[0], d_dm))
             candidates.append(candidate)
 
     return candidates
@@ -226,6 +250,7 @@ def search_candidates_ell(image, x_stddev, x_cos_theta,
 
 def search_candidates_shear(image, t_0, d_t, d_dm, mph=3.5, mpd=50,
                             original_dsp=None, shear=0.4):
+    image = np.asarray(image)
     tform = AffineTransform(shear=shear)
     warped_image = warp(image, tform)
     warped = np.sum(warped_image, axis=0)
@@ -239,7 +264,7 @@ def search_candidates_shear(image, t_0, d_t, d_dm, mph=3.5, mpd=50,
     candidates = list()
     for i, (t_indx, dm_indx) in enumerate(zip(indxs, dm_indxs)):
         candidate = Candidate(t_0 + t_indx * TimeDelta(d_t, format='sec'),
-                              dm_indx * float(d_dm))
+                              dm_from_index(dm_indx, d_dm))
         candidates.append(candidate)
         if original_dsp is not None:
             plot_rect_original_dsp(t_indx, 50,
@@ -250,6 +275,120 @@ def search_candidates_shear(image, t_0, d_t, d_dm, mph=3.5, mpd=50,
     return candidates
 
 
+def boxcar_snr(row, widths):
+    """
+    Convolve 1D array with bank of boxcars of different widths.
+
+    Data is normalized using robust estimates of location (median) and scale
+    (MAD) before convolution. Convolution with each boxcar is difference of
+    prefix sums, so it costs ``O(len(row))`` regardless of width.
+
+    :param row:
+        1D array-like.
+    :param widths:
+        Iterable of widths of boxcars [samples].
+
+    :return:
+        Two numpy arrays with the same length as ``row`` - maximal over
+        ``widths`` SNR of boxcar centered on each sample and corresponding
+        width.
+    """
+    row = np.asarray(row, dtype=float)
+    n = len(row)
+    std = mad_std(row)
+    if not std:
+        std = np.std(row) or 1.
+    prefix = np.zeros(n + 1)
+    np.cumsum(row - np.median(row), out=prefix[1:])
+    snr = np.empty(n)
+    snr.fill(-np.inf)
+    best_widths = np.zeros(n, dtype=int)
+    for width in widths:
+        if width > n:
+            continue
+        snr_ = (prefix[width:] - prefix[:-width]) / (std * np.sqrt(width))
+        # Align boxcar sums with central sample of boxcar
+        center = slice(width // 2, width // 2 + n - width + 1)
+        better = snr_ > snr[center]
+        snr[center][better] = snr_[better]
+        best_widths[center][better] = width
+    return snr, best_widths
+
+
+def search_candidates_boxcar(image, t_0, d_t, d_dm, widths=(1, 2, 4, 8, 16,
+                                                            32),
+                             n_sigma=6., mpd=50, original_dsp=None):
+    """
+    Search FRB in de-dispersed dynamical spectra by matched filtering every
+    row of `t-DM` plane with bank of boxcars (see ``boxcar_snr``).
+
+    :param image:
+        2D numpy.ndarray of de-dispersed dynamical spectra. Any object with
+        ``shape`` and row indexing (e.g. ``h5py.Dataset``) could be used - it
+        is processed one row at a time. Rows of
+        ``dedispersion.MultiResolutionTDM`` are searched in their own time
+        resolution with widths of boxcars decimated accordingly.
+    :param t_0:
+        Time of the first sample (instance of ``astropy.time.Time``).
+    :param d_t:
+        Time step [s].
+    :param d_dm:
+        Step of DM grid or DM grid itself [cm^3/pc] (see ``dm_from_index``).
+    :param widths: (optional)
+        Iterable of widths of boxcars [samples]. (default: ``(1, 2, 4, 8, 16,
+        32)``)
+    :param n_sigma: (optional)
+        Threshold of SNR for candidates. (default: ``6.``)
+    :param mpd: (optional)
+        Minimal distance between candidates [samples]. (default: ``50``)
+
+    :return:
+        List of ``Candidate`` instances with width and SNR of the best
+        boxcar.
+    """
+    if isinstance(image, MultiResolutionTDM):
+        rows = image.iter_rows()
+    else:
+        if not hasattr(image, '__getitem__'):
+            image = np.asarray(image)
+        rows = ((i, 1, image[i]) for i in range(image.shape[0]))
+    n_dm, n_t = image.shape
+    d_t = TimeDelta(d_t, format='sec')
+
+    # For each sample keep the best SNR over all values of DM & widths
+    best_snr = np.empty(n_t)
+    best_snr.fill(-np.inf)
+    best_widths = np.zeros(n_t, dtype=int)
+    best_dm_indxs = np.zeros(n_t, dtype=int)
+    for i, factor, row in rows:
+        if factor == 1:
+            snr, row_widths = boxcar_snr(row, widths)
+        else:
+            # Boxcars in decimated time steps, results mapped back to
+            # original time steps
+            widths_ = sorted(set(max(1, width // factor) for width in widths))
+            snr, row_widths = boxcar_snr(row, widths_)
+            snr = np.repeat(snr, factor)
+            row_widths = np.repeat(row_widths * factor, factor)
+        n = len(snr)
+        better = snr > best_snr[:n]
+        best_snr[:n][better] = snr[better]
+        best_widths[:n][better] = row_widths[better]
+        best_dm_indxs[:n][better] = i
+
+    indxs = detect_peaks(np.where(np.isfinite(best_snr), best_snr, 0.),
+                         mph=n_sigma, mpd=mpd)
+    candidates = list()
+    for t_indx in indxs:
+        candidate = Candidate(t_0 + t_indx * d_t,
+                              dm_from_index(best_dm_indxs[t_indx], d_dm),
+                              width=best_widths[t_indx] * d_t.sec,
+                              snr=best_snr[t_indx])
+        candidates.append(candidate)
+
+    return candidates
+
+
 def plot_prop_original_dsp(prop, original_dsp=None, colorbar_label=None,
                            close=False, save_file=None, show=True):
     fig, ax = matplotlib.pyplot.subplots(1, 1)
@@ -351,7 +490,9 @@ def create_ellipses(tdm_image, disk_size=3, threshold_big_perc=97.5,
     opening and thresholding.
 
     :param tdm_image:
-        2D numpy.ndarray  of `t-DM` plane.
+        2D numpy.ndarray  of `t-DM` plane or instance of
+        ``dedispersion.MultiResolutionTDM`` (it is expanded to the full time
+        resolution, as filtering needs the whole plane).
     :param disk_size: (optional)
         Disk size to use when calculating filtered values. (default: ``3``)
     :param threshold_big_perc: (optional)
@@ -376,6 +517,7 @@ def create_ellipses(tdm_image, disk_size=3, threshold_big_perc=97.5,
     statistic_dict = {'mean': circular_mean, 'median': circular_median,
                       'gauss': gaussian_filter}
 
+    tdm_image = np.asarray(tdm_image)
     if threshold_big_perc is not None:
         image = tdm_image.copy()
         image = statistic_dict[statistic](image, disk_size)
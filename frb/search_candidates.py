@@ -6,6 +6,11 @@ import hashlib
 import numpy as np
 from astropy.time import TimeDelta
 from queries import connect_to_db
+from dedispersion import MultiResolutionTDM
+
+
+# Number of elements in block of DM rows pre-processed out-of-core
+_pre_process_block_size = 2 ** 24
 
 
 class Searcher(object):
@@ -18,9 +23,24 @@ class Searcher(object):
     :param cache_dir: (optional)
         Directory to store cache HDF5 files. If ``None`` - use CWD. (default:
         ``None``)
+    :param out_of_core: (optional)
+        Boolean. If ``True`` then de-dispersion function writes result
+        directly to dataset of HDF5 cache file (it must accept ``out`` keyword
+        argument, e.g. ``noncoherent_dedisperse`` without ``threads``,
+        ``n_subbands`` and ``decimate``, and the first positional argument
+        must be DM grid), so whole result is never kept in memory.
+        Pre-processing function is applied to blocks of DM rows read from
+        this dataset and its results are written block by block to dataset of
+        pre-processing cache file. Thus it must process rows independently
+        (functions that use the whole `t-DM` plane, e.g. ``create_ellipses``,
+        need ``out_of_core=False``). Searching function gets resulting dataset
+        as read-only array-like with rows read on demand (e.g.
+        ``search_candidates_boxcar`` reads one row at a time). (default:
+        ``False``)
     """
-    def __init__(self, dsp, cache_dir=None):
+    def __init__(self, dsp, cache_dir=None, out_of_core=False):
         self.dsp = dsp
+        self.out_of_core = out_of_core
         self.meta_data = dsp.meta_data.copy()
 
         # This needed for string conversion
@@ -69,13 +89,39 @@ class Searcher(object):
         result = self._de_dispersed_cache.get(key, None)
         if result is not None:
             print "Found cached de-dispersed data..."
-            result = result.value
+            if isinstance(result, h5py.Group):
+                result = MultiResolutionTDM.from_hdf5(result)
+            elif not self.out_of_core:
+                result = result.value
+        elif self.out_of_core:
+            n_dm = len(np.atleast_1d(args[0]))
+            # Write to temporary dataset, so failed de-dispersion doesn't leave
+            # incomplete data in cache
+            tmp_key = key + '_tmp'
+            if tmp_key in self._de_dispersed_cache:
+                del self._de_dispersed_cache[tmp_key]
+            result = self._de_dispersed_cache.create_dataset(
+                tmp_key, shape=(n_dm, self.dsp.n_t), dtype=float, chunks=True,
+                maxshape=(None, None), compression='gzip')
+            try:
+                de_disp_func(self.dsp, *args, out=result, **kwargs)
+            except:
+                del self._de_dispersed_cache[tmp_key]
+                self._de_dispersed_cache.flush()
+                raise
+            self._de_dispersed_cache.move(tmp_key, key)
+            result = self._de_dispersed_cache[key]
+            self._de_dispersed_cache.flush()
         else:
             result = de_disp_func(self.dsp, *args, **kwargs)
-            # Put to cache
-            self._de_dispersed_cache.create_dataset(key, data=result,
-                                                    chunks=True,
-                                                    compression='gzip')
+            # Put to cache. Decimated image is kept in its own resolution.
+            if isinstance(result, MultiResolutionTDM):
+                group = self._de_dispersed_cache.create_group(key)
+                result.to_hdf5(group, chunks=True, compression='gzip')
+            else:
+                self._de_dispersed_cache.create_dataset(key, data=result,
+                                                        chunks=True,
+                                                        compression='gzip')
             self._de_dispersed_cache.flush()
         self._de_dispersed_data = result
         self._de_disp_m = m.copy()
@@ -110,10 +156,15 @@ class Searcher(object):
             result = self._preprocessed_cache.get(key, None)
             if result is not None:
                 print "Found cached preprocessed data..."
-                result = result.value
+                if not self.out_of_core:
+                    result = result.value
+            elif self.out_of_core:
+                result = self._pre_process_blocks(key, preprocess_func, *args,
+                                                  **kwargs)
             else:
-                result = preprocess_func(self._de_dispersed_data.copy(), *args,
-                                         **kwargs)
+                # Copy, so pre-processing in place doesn't change cached data
+                result = preprocess_func(self._de_dispersed_data.copy(),
+                                         *args, **kwargs)
                 self._preprocessed_cache.create_dataset(key, data=result,
                                                         chunks=True,
                                                         compression='gzip')
@@ -121,6 +172,42 @@ class Searcher(object):
 
         self._pre_processed_data = result
 
+    def _pre_process_blocks(self, key, preprocess_func, *args, **kwargs):
+        """
+        Pre-process out-of-core de-dispersed data one block of DM rows at a
+        time writing results to dataset of pre-processing cache.
+
+        :return:
+            Instance of ``h5py.Dataset`` with pre-processed data.
+        """
+        data = self._de_dispersed_data
+        n_dm, n_t = data.shape
+        n_dm_block = max(1, _pre_process_block_size // n_t)
+        # Write to temporary dataset, so failed pre-processing doesn't leave
+        # incomplete data in cache
+        tmp_key = key + '_tmp'
+        if tmp_key in self._preprocessed_cache:
+            del self._preprocessed_cache[tmp_key]
+        try:
+            result = None
+            for start in range(0, n_dm, n_dm_block):
+                stop = min(start + n_dm_block, n_dm)
+                block = preprocess_func(data[start: stop], *args, **kwargs)
+                if result is None:
+                    result = self._preprocessed_cache.create_dataset(
+                        tmp_key, shape=(n_dm,) + block.shape[1:],
+                        dtype=block.dtype, chunks=True,
+                        maxshape=(None,) * block.ndim, compression='gzip')
+                result[start: stop] = block
+        except:
+            if tmp_key in self._preprocessed_cache:
+                del self._preprocessed_cache[tmp_key]
+            self._preprocessed_cache.flush()
+            raise
+        self._preprocessed_cache.move(tmp_key, key)
+        self._preprocessed_cache.flush()
+        return self._preprocessed_cache[key]
+
     def search(self, search_func, *args, **kwargs):
         """
         Search candidates in optionally preprocessed dynamical spectra.
@@ -131,8 +218,12 @@ class Searcher(object):
         kwargs.update({'t_0': self.dsp.t_0,
                        'd_t': self.dsp.d_t,
                        'original_dsp': self.dsp.values})
-        candidates = search_func(self._pre_processed_data.copy(), *args,
-                                 **kwargs)
+        data = self._pre_processed_data
+        if isinstance(data, h5py.Dataset):
+            data = _ReadOnlyDataset(data)
+        else:
+            data = data.copy()
+        candidates = search_func(data, *args, **kwargs)
 
         return candidates
 
@@ -209,3 +300,90 @@ class Searcher(object):
 
         return candidates
 
+    def iter_chunks(self, duration, overlap=0., dm_max=None):
+        """
+        Iterate over searchers of consecutive chunks of dynamical spectra (see
+        ``DynSpectra.iter_chunks``).
+
+        :return:
+            Generator of ``Searcher`` instances with the same cache directory
+            and mode.
+        """
+        for chunk in self.dsp.iter_chunks(duration, overlap=overlap,
+                                          dm_max=dm_max):
+            yield Searcher(chunk, cache_dir=self.cache_dir,
+                           out_of_core=self.out_of_core)
+
+    def run_chunks(self, duration, de_disp_func, search_func, overlap=0.,
+                   dm_max=None, **kwargs):
+        """
+        Search candidates chunk by chunk.
+
+        :param duration:
+            Time between starts of chunks [s].
+        :param de_disp_func:
+            Function that used to de-disperse dynamical spectra.
+        :param search_func:
+            Function that used to search candidates.
+        :param overlap: (optional)
+            Time that each chunk extends into the next one [s]. (default:
+            ``0.``)
+        :param dm_max: (optional)
+            Maximum DM to search [cm^3 / pc]. If not ``None`` then overlap is
+            at least twice dispersion delay across band for this DM.
+            (default: ``None``)
+        :param kwargs:
+            Other keyword arguments of ``run`` method.
+
+        :return:
+            Generator of lists of ``Candidate`` instances for each chunk.
+
+        :note:
+            Each chunk reports only candidates that start between the middles
+            of its leading and trailing overlaps (the first and the last
+            chunks - from the start and up to the end of data). If overlap is
+            twice the delay across band then pulses reported by chunk are
+            entirely in it and tails of pulses from previous chunk are not
+            reported again.
+        """
+        if dm_max is not None:
+            overlap = max(overlap, 2. * self.dsp.max_delay(dm_max))
+        d_t = self.dsp.d_t.sec
+        n_step = int(round(duration / d_t))
+        n_half = int(np.ceil(overlap / d_t - 1e-6)) // 2
+        for i, searcher in enumerate(self.iter_chunks(duration,
+                                                      overlap=overlap)):
+            candidates = searcher.run(de_disp_func, search_func, **kwargs)
+            t_0 = searcher.dsp.t_0
+            if i:
+                t_start = (t_0 + n_half * self.dsp.d_t).utc.datetime
+                candidates = [candidate for candidate in candidates if
+                              candidate.t >= t_start]
+            # All candidates of the last chunk are kept
+            if (self.dsp.t_end - searcher.dsp.t_end).sec > 0.5 * d_t:
+                t_stop = (t_0 + (n_step + n_half) *
+                          self.dsp.d_t).utc.datetime
+                candidates = [candidate for candidate in candidates if
+                              candidate.t < t_stop]
+            yield candidates
+
+
+class _ReadOnlyDataset(object):
+    """
+    Read-only array-like wrapper of HDF5 dataset. Indexed rows are read on
+    demand, so cached data is never changed.
+    """
+    def __init__(self, dset):
+        self._dset = dset
+        self.shape = dset.shape
+        self.dtype = dset.dtype
+        self.ndim = len(dset.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        return self._dset[key]
+
+    def __array__(self, dtype=None):
+        return np.asarray(self._dset[...], dtype=dtype)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Storage backends for values of dynamical spectra (2D arrays (#ch, #t,)).
+
+``shared``
+    ``float32`` array in shared memory (``multiprocessing.Array``).
+``numpy``
+    Plain ``float32`` numpy array.
+``memmap``
+    ``float32`` array memory-mapped to file (``numpy.memmap``).
+``hdf5``
+    Dataset of HDF5-file (``h5py.Dataset``). Data is read only when it is
+    indexed.
+"""
+import multiprocessing
+import ctypes
+import numpy as np
+
+
+backends = ('shared', 'numpy', 'memmap', 'hdf5')
+
+
+def shared_array(n_nu, n_t):
+    """
+    Create 2D numpy array (#ch, #t) of zeros in shared memory.
+    """
+    # Using shared array (http://stackoverflow.com/questions/5549190 by pv.)
+    shared_array_base = multiprocessing.Array(ctypes.c_float, n_nu * n_t)
+    return np.ctypeslib.as_array(shared_array_base.get_obj()).reshape((n_nu,
+                                                                       n_t,))
+
+
+def create_storage(n_nu, n_t, backend='shared', fname=None, name='dsp'):
+    """
+    Create 2D array (#ch, #t) of zeros with given backend.
+
+    :param n_nu:
+        Number of spectral channels.
+    :param n_t:
+        Number of time steps.
+    :param backend: (optional)
+        One of ``shared``, ``numpy``, ``memmap`` or ``hdf5``. (default:
+        ``shared``)
+    :param fname: (optional)
+        File to store data for ``memmap`` and ``hdf5`` backends. (default:
+        ``None``)
+    :param name: (optional)
+        Name of dataset for ``hdf5`` backend. (default: ``dsp``)
+
+    :return:
+        Numpy array or ``h5py.Dataset``.
+    """
+    if backend not in backends:
+        raise Exception("Unknown storage backend {}. Use one of"
+                        " {}".format(backend, backends))
+    if backend == 'shared':
+        return shared_array(n_nu, n_t)
+    if backend == 'numpy':
+        return np.zeros((n_nu, n_t), dtype=np.float32)
+    if fname is None:
+        raise Exception("File name is needed for {} backend".format(backend))
+    if backend == 'memmap':
+        return np.memmap(fname, dtype=np.float32, mode='w+',
+                         shape=(n_nu, n_t))
+    import h5py
+    f = h5py.File(fname, 'a')
+    return f.create_dataset(name, shape=(n_nu, n_t), dtype=np.float32,
+                            fillvalue=0.)
+
+
+def open_hdf5(fname, name='dsp', mode='r'):
+    """
+    Open dataset of HDF5-file without reading it to memory.
+
+    :param fname:
+        HDF5-file.
+    :param name: (optional)
+        Name of dataset. (default: ``dsp``)
+    :param mode: (optional)
+        ``r``, ``r+`` or ``c``. ``c`` memory-maps data copy-on-write (it
+        could be changed in memory, but file isn't changed), datasets that
+        can't be memory-mapped are opened read-only. (default: ``r``)
+
+    :return:
+        Array-like with data and dictionary with metadata (attributes of
+        dataset). Contiguous uncompressed datasets are memory-mapped
+        (``numpy.memmap``), other ones are returned as ``h5py.Dataset``.
+    """
+    import h5py
+    f = h5py.File(fname, 'r' if mode == 'c' else mode)
+    dset = f[name]
+    meta_data = dict()
+    for key, value in dset.attrs.items():
+        meta_data.update({str(key): value})
+    offset = dset.id.get_offset()
+    if dset.chunks is None and offset is not None:
+        values = np.memmap(fname, dtype=dset.dtype, mode=mode,
+                           offset=offset, shape=dset.shape)
+        f.close()
+        return values, meta_data
+    return dset, meta_data
+
+
+def is_in_memory(values):
+    """
+    Check if values of dynamical spectra are numpy array (including
+    ``numpy.memmap``) that supports all array operations.
+    """
+    return isinstance(values, np.ndarray)
+
+
+def is_writeable(values):
+    """
+    Check if values of dynamical spectra could be changed in place.
+    """
+    if is_in_memory(values):
+        return values.flags.writeable
+    h5file = getattr(values, 'file', None)
+    if h5file is not None:
+        return h5file.mode != 'r'
+    return True
+
+
+def read_into(values, out, n_rows=16, start=0):
+    """
+    Copy values of dynamical spectra to numpy array. Values that are not numpy
+    arrays (e.g. ``h5py.Dataset``) are read by blocks of rows, so no
+    temporary copy of the whole data is created.
+
+    :param values:
+        Array-like (#ch, #t,).
+    :param out:
+        Numpy array with the same number of time steps.
+    :param n_rows: (optional)
+        Number of rows in block. (default: ``16``)
+    :param start: (optional)
+        Index of the first row of ``values`` to copy. ``out`` gets its number
+        of rows starting from this one. (default: ``0``)
+    """
+    n_out = out.shape[0]
+    if is_in_memory(values):
+        out[:] = values[start: start + n_out]
+        return out
+    for i in range(0, n_out, n_rows):
+        out[i: i + n_rows] = values[start + i: start + min(i + n_rows, n_out)]
+    return out
@@ -187,7 +187,7 @@ static int spec(struct mark5_stream *ms, const struct fft_data_t *fft_data,
 
 static int work(const char *input_filename, const char *format,
                 unsigned nchan, double aver_time, double total_time, double offset,
-                const char *out_filename_base)
+                const char *out_filename_base, int binary)
 {
     struct mark5_stream *ms;
     struct fft_data_t fft_data;
@@ -198,6 +198,7 @@ static int work(const char *input_filename, const char *format,
     size_t k, step_num = 0;  /* Number of time steps */
     FILE **out_files;
     char *out_filename;
+    float *out_spec;
 
     ms = new_mark5_stream_absorb(new_mark5_stream_file(input_filename, 0LL),
                                  new_mark5_format_generic_from_string(format));
@@ -216,7 +217,7 @@ static int work(const char *input_filename, const char *format,
     out_files = (FILE **)malloc(ms->nchan * sizeof(FILE *));
     for(i = 0; i < ms->nchan; ++i){
         sprintf(out_filename, "%s_%02d", out_filename_base, i+1);
-        out_files[i] = fopen(out_filename, "w");
+        out_files[i] = fopen(out_filename, binary ? "wb" : "w");
         if(!out_files[i]){
             perror("Could not open output file");
 
@@ -234,12 +235,20 @@ static int work(const char *input_filename, const char *format,
 
     /* Prepare data arrays */
     fft_data_init(&fft_data, nchan, ms->nchan);
+    out_spec = (float *)malloc(nchan * sizeof(float));
 
     for(k = 0; k < step_num; ++k){
         if(spec(ms, &fft_data, nint))
             break;
 
         for(i = 0; i < ms->nchan; i++){
+            if(binary){
+                /* Raw float32 spectra, one row of nchan values per time step */
+                for(c = 0; c < nchan; ++c)
+                    out_spec[c] = (float)(fft_data.spec[i][c] / (double)nint);
+                fwrite(out_spec, sizeof(float), nchan, out_files[i]);
+                continue;
+            }
             for(c = 0; c < nchan; ++c){
                 fprintf(out_files[i], "%lf ", fft_data.spec[i][c] / (double)nint);
             }
@@ -253,6 +262,7 @@ static int work(const char *input_filename, const char *format,
     for(i = 0; i < ms->nchan; ++i)
         fclose(out_files[i]);
     free(out_files);
+    free(out_spec);
     fft_data_free(&fft_data);
     delete_mark5_stream(ms);
 
@@ -261,7 +271,7 @@ static int work(const char *input_filename, const char *format,
 
 static void usage(const char *prog_name)
 {
-    printf("Usage: %s [-a aver_time] [-n nchan] [-l time_limit] [-o offset] INFILE FORMAT OUTFILE \n\n",
+    printf("Usage: %s [-a aver_time] [-n nchan] [-l time_limit] [-o offset] [-b] INFILE FORMAT OUTFILE \n\n",
             prog_name);
     printf("INFILE    - the name of the input file\n");
     printf("FORMAT    - mark5access data format in form <FORMAT>-<Mbps>-<nchan>-<nbit>\n");
@@ -272,6 +282,7 @@ Output files will be called 'OUTFILE_n', where n is channel number\n");
     printf("  -n nchan      - number of spectral channels (128)\n");
     printf("  -l time_limit - total time in seconds\n");
     printf("  -o offset     - offset in seconds from the file beginnig (0)\n");
+    printf("  -b            - write binary float32 spectra instead of text\n");
 }
 
 int main(int argc, char *argv[])
@@ -283,9 +294,10 @@ int main(int argc, char *argv[])
     double aver_time = 1e-3;    /* 1ms */
     double total_time = 1200;   /* 20 min */
     double offset = 0.0;        /* No offset */
+    int binary = 0;             /* Text output */
 
     /* Check input parameters */
-    while((opt = getopt(argc, argv, "n:a:l:o:h")) != -1){
+    while((opt = getopt(argc, argv, "n:a:l:o:bh")) != -1){
         switch(opt){
             case 'n':
                 nchan = atoi(optarg);
@@ -319,6 +331,9 @@ int main(int argc, char *argv[])
                     exit(EXIT_FAILURE);
                 }
                 break;
+            case 'b':
+                binary = 1;
+                break;
             case 'h':
                 usage(argv[0]);
                 exit(EXIT_SUCCESS);
@@ -334,7 +349,7 @@ int main(int argc, char *argv[])
     }
 
     ret = work(argv[optind], argv[optind+1], nchan, aver_time, total_time, offset,
-               argv[optind+2]);
+               argv[optind+2], binary);
 
     return ret;
 }
@@ -11,9 +11,13 @@ import numpy as np
 import sys
 
 
-def main(file_name):
+def main(file_name, n_chan=None):
     try:
-        data = np.loadtxt(file_name, unpack=True)
+        if n_chan is None:
+            data = np.loadtxt(file_name, unpack=True)
+        else:
+            # Binary float32 file (``-b`` option of ``my5spec``)
+            data = np.fromfile(file_name, dtype='<f4').reshape((-1, n_chan)).T
     except IOError as err:
         print('IOError: ', err, file=sys.stderr)
         return 1
@@ -27,8 +31,10 @@ def main(file_name):
     return 0
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print('Usage: {} FILE'.format(sys.argv[0]))
+    if len(sys.argv) not in (2, 3):
+        print('Usage: {} FILE [NCHAN]'.format(sys.argv[0]))
+        print('NCHAN - number of channels of binary file')
         sys.exit(2)
 
-    sys.exit(main(sys.argv[1]))
+    n_chan = int(sys.argv[2]) if len(sys.argv) == 3 else None
+    sys.exit(main(sys.argv[1], n_chan))
@@ -0,0 +1,308 @@
+import pytest
+import numpy as np
+from frb.dyn_spectra import DynSpectra
+from frb.dedispersion import (noncoherent_dedisperse, tree_dedisperse,
+                             fdmt_dedisperse, fdmt_dm_grid, subband_smearing,
+                             DedispersionPlan, get_plan, get_pool,
+                             stream_dedisperse, IncrementalDedisperser,
+                             decimation_factors, MultiResolutionTDM,
+                             coherent_dedisperse,
+                             batch_dedisperse)
+
+
+meta_data = {'antenna': 'WB', 'freq': 'L', 'band': 'U', 'pol': 'R',
+             'exp_code': 'raks00'}
+
+
+def create_dsp(n_nu=64, n_t=2000, nu_0=1684., d_nu=16./64, d_t=0.001,
+               pulses=((0.5, 3., 0.002, 300.),)):
+    np.random.seed(123)
+    dsp = DynSpectra(n_nu, n_t, nu_0, d_nu, d_t, meta_data=meta_data)
+    dsp.add_noise(0.1)
+    for pulse in pulses:
+        dsp.add_pulse(*pulse)
+    return dsp
+
+
+def test_tree_dedisperse():
+    dsp = create_dsp()
+    dm_grid = np.arange(0., 1000., 50.)
+    tdm = tree_dedisperse(dsp, dm_grid)
+    tdm_ = noncoherent_dedisperse(dsp, dm_grid)
+    assert tdm.shape == tdm_.shape
+    assert np.allclose(tdm[0], tdm_[0])
+    assert (np.unravel_index(np.argmax(tdm), tdm.shape) ==
+            np.unravel_index(np.argmax(tdm_), tdm_.shape))
+    assert np.allclose(tdm.max(), tdm_.max(), rtol=0.05)
+
+
+def test_tree_dedisperse_large_delays():
+    # Delay across band exceeds number of channels several times
+    dsp = create_dsp(n_nu=32, nu_0=340., d_nu=0.25,
+                     pulses=((0.3, 3., 0.003, 150.),))
+    dm_grid = np.arange(100., 200., 10.)
+    tdm = tree_dedisperse(dsp, dm_grid)
+    tdm_ = noncoherent_dedisperse(dsp, dm_grid)
+    assert (np.unravel_index(np.argmax(tdm), tdm.shape) ==
+            np.unravel_index(np.argmax(tdm_), tdm_.shape))
+    assert np.allclose(tdm.max(), tdm_.max(), rtol=0.05)
+
+
+def test_fdmt_dedisperse():
+    dsp = create_dsp(n_nu=32, nu_0=340., d_nu=0.25,
+                     pulses=((0.3, 3., 0.003, 150.),))
+    dm_grid = np.arange(100., 200., 10.)
+    tdm = fdmt_dedisperse(dsp, dm_grid)
+    tdm_ = noncoherent_dedisperse(dsp, dm_grid)
+    assert tdm.shape == tdm_.shape
+    assert (np.unravel_index(np.argmax(tdm), tdm.shape) ==
+            np.unravel_index(np.argmax(tdm_), tdm_.shape))
+    assert np.allclose(tdm.max(), tdm_.max(), rtol=0.05)
+
+    tdm = fdmt_dedisperse(dsp, 200.)
+    dm_grid = fdmt_dm_grid(dsp, 200.)
+    assert tdm.shape == (len(dm_grid), dsp.n_t)
+    assert np.allclose(tdm[0], dsp.values.mean(axis=0))
+    assert abs(dm_grid[np.unravel_index(np.argmax(tdm), tdm.shape)[0]] -
+               150.) < 5.
+    with pytest.raises(ValueError):
+        fdmt_dedisperse(dsp, np.arange(-100., 100., 10.))
+
+
+def test_subband_dedisperse():
+    dsp = create_dsp()
+    dm_grid = np.arange(0., 1000., 50.)
+    tdm = noncoherent_dedisperse(dsp, dm_grid, n_subbands=8)
+    tdm_ = noncoherent_dedisperse(dsp, dm_grid)
+    assert tdm.shape == tdm_.shape
+    assert (np.unravel_index(np.argmax(tdm), tdm.shape) ==
+            np.unravel_index(np.argmax(tdm_), tdm_.shape))
+    assert np.allclose(tdm.max(), tdm_.max(), rtol=0.05)
+    smearing = subband_smearing(dsp, dm_grid, 8)
+    assert smearing.shape == dm_grid.shape
+    assert np.all(smearing >= dsp.d_t.sec)
+    # One sub-band per channel is direct de-dispersion
+    assert np.allclose(noncoherent_dedisperse(dsp, dm_grid,
+                                              n_subbands=dsp.n_nu), tdm_)
+    # Both stages in worker processes
+    assert np.allclose(noncoherent_dedisperse(dsp, dm_grid, n_subbands=8,
+                                              threads=2), tdm, atol=1e-5)
+
+
+def test_dedispersion_plan():
+    dsp = create_dsp()
+    dm_grid = np.arange(0., 1000., 50.)
+    plan = DedispersionPlan.from_dsp(dsp, dm_grid)
+    assert plan.matches(dsp)
+    tdm = plan.dedisperse(dsp.values)
+    for i, shifts in enumerate(plan.shifts):
+        row = np.zeros(dsp.n_t)
+        for values, shift in zip(dsp.values, shifts):
+            row += np.roll(values, -shift)
+        assert np.allclose(tdm[i], row)
+    tdm_valid = plan.dedisperse(dsp.values, wrap=False)
+    assert tdm_valid.shape == (len(dm_grid), dsp.n_t - plan.max_shift)
+    assert np.allclose(tdm_valid, tdm[:, :dsp.n_t - plan.max_shift])
+    assert get_plan(dsp.nu, dsp.d_t.sec, dm_grid) is get_plan(dsp.nu,
+                                                              dsp.d_t.sec,
+                                                              dm_grid)
+    # Negative DM values are only supported with wrapping
+    plan = DedispersionPlan.from_dsp(dsp, np.arange(-100., 100., 50.))
+    tdm = plan.dedisperse(dsp.values)
+    for i, shifts in enumerate(plan.shifts):
+        row = np.zeros(dsp.n_t)
+        for values, shift in zip(dsp.values, shifts):
+            row += np.roll(values, -shift)
+        assert np.allclose(tdm[i], row)
+    with pytest.raises(ValueError):
+        plan.dedisperse(dsp.values, wrap=False)
+
+
+def test_dedispersion_pool():
+    dsp = create_dsp()
+    dm_grid = np.arange(0., 1000., 50.)
+    tdm = noncoherent_dedisperse(dsp, dm_grid)
+    assert np.allclose(noncoherent_dedisperse(dsp, dm_grid, threads=2), tdm)
+    # Pool is reused by the next call and handles few DM values
+    pool = get_pool(2)
+    assert np.allclose(noncoherent_dedisperse(dsp, dm_grid[:1], threads=2),
+                       tdm[:1])
+    assert get_pool(2) is pool
+
+
+def test_stream_dedisperse():
+    dsp = create_dsp(pulses=((0.95, 3., 0.002, 500.),))
+    dm_grid = np.arange(0., 1000., 50.)
+    chunks = list()
+    for i in range(4):
+        chunk = DynSpectra(dsp.n_nu, 500, dsp.nu_0, dsp.d_nu, dsp.d_t,
+                           meta_data=meta_data, t_0=dsp.t_0 + 500 * i *
+                           dsp.d_t)
+        chunk.add_values(dsp.values[:, 500 * i: 500 * (i + 1)])
+        chunks.append(chunk)
+    results = list(stream_dedisperse(chunks, dm_grid))
+    tdm = np.hstack([tdm for t_0, tdm in results])
+    plan = get_plan(dsp.nu, dsp.d_t.sec, dm_grid)
+    assert np.allclose(tdm, plan.dedisperse(dsp.values, wrap=False) /
+                       dsp.n_nu)
+    assert abs((results[1][0] - dsp.t_0).sec -
+               results[0][1].shape[1] * dsp.d_t.sec) < 1e-6
+    with pytest.raises(ValueError):
+        list(stream_dedisperse(chunks, np.arange(-100., 100., 50.)))
+
+
+def test_incremental_dedisperse():
+    dsp = create_dsp()
+    dm_grid = np.arange(0., 1000., 50.)
+    plan = get_plan(dsp.nu, dsp.d_t.sec, dm_grid)
+    growing = DynSpectra(dsp.n_nu, 3, dsp.nu_0, dsp.d_nu, dsp.d_t,
+                         meta_data=meta_data, t_0=dsp.t_0)
+    growing.add_values(dsp.values[:, :3])
+    incremental = IncrementalDedisperser(plan)
+    incremental.update(growing)
+    for start, stop in ((3, 10), (10, 700), (700, 701), (701, dsp.n_t)):
+        growing.append(dsp.values[:, start: stop])
+        new = incremental.update(growing)
+        assert new.shape[1] == max(0, stop - plan.max_shift) -\
+            max(0, start - plan.max_shift)
+    assert np.allclose(growing.values, dsp.values)
+    assert np.allclose(incremental.tdm,
+                       plan.dedisperse(dsp.values, wrap=False))
+    with pytest.raises(ValueError):
+        IncrementalDedisperser(get_plan(dsp.nu, dsp.d_t.sec,
+                                        np.arange(-100., 100., 50.)))
+
+
+def test_decimated_dedisperse():
+    dsp = create_dsp(n_nu=64, n_t=4000, nu_0=340., d_nu=0.25,
+                     pulses=((1., 3., 0.01, 500.),))
+    dm_grid = np.arange(0., 1000., 25.)
+    factors = decimation_factors(dsp.nu, dsp.d_nu, dsp.d_t.sec, dm_grid)
+    assert factors[0] == 1
+    assert factors[-1] > 1
+    assert np.all(np.diff(factors) >= 0)
+    tdm = noncoherent_dedisperse(dsp, dm_grid, decimate=True)
+    tdm_ = noncoherent_dedisperse(dsp, dm_grid)
+    assert isinstance(tdm, MultiResolutionTDM)
+    assert tdm.nbytes < tdm_.nbytes
+    image = np.asarray(tdm)
+    assert image.shape == tdm_.shape
+    # Rows without decimation are the same
+    assert np.allclose(image[factors == 1], tdm_[factors == 1])
+    i, j = np.unravel_index(np.argmax(image), image.shape)
+    i_, j_ = np.unravel_index(np.argmax(tdm_), tdm_.shape)
+    assert abs(dm_grid[i] - 500.) <= 25.
+    assert abs(j - j_) <= factors[i]
+
+
+def test_coherent_dedisperse():
+    np.random.seed(123)
+    n = 2 ** 18
+    bandwidth = 16.
+    voltages = 0.1 * np.random.normal(size=n)
+    voltages[n // 2: n // 2 + 32] += 5. * np.random.normal(size=32)
+    for sideband in ('U', 'L'):
+        dispersed = coherent_dedisperse(voltages, 1668., bandwidth, -50.,
+                                        sideband=sideband)
+        # Pulse is smeared by dispersion
+        assert np.max(dispersed ** 2.) < 0.2 * np.max(voltages ** 2.)
+        dedispersed = coherent_dedisperse(dispersed, 1668., bandwidth, 50.,
+                                          sideband=sideband)
+        assert n // 2 <= np.argmax(dedispersed ** 2.) < n // 2 + 32
+        # Only Nyquist frequency is lost
+        assert np.corrcoef(dedispersed[n // 4: 3 * n // 4],
+                           voltages[n // 4: 3 * n // 4])[0, 1] > 0.9999
+
+
+def test_weights():
+    dsp = create_dsp(n_t=1000)
+    # Reference with bad data zeroed
+    dsp_zeroed = create_dsp(n_t=1000)
+    dsp_zeroed.values[:4] = 0.
+    dsp_zeroed.values[20, 100:200] = 0.
+    dsp.values[:4] = 1000.
+    dsp.values[20, 100:200] = 1000.
+    dsp.mask_channels(slice(0, 4))
+    mask = np.zeros(dsp.values.shape, dtype=bool)
+    mask[20, 100:200] = True
+    dsp.mask_samples(mask)
+    assert dsp.n_nu_eff == 60.
+
+    dm_grid = np.arange(0., 1000., 50.)
+    scale = float(dsp.n_nu) / dsp.n_nu_eff
+    for engine, kwargs in ((noncoherent_dedisperse, {}),
+                           (noncoherent_dedisperse, {'threads': 2}),
+                           (noncoherent_dedisperse, {'n_subbands': 8}),
+                           (tree_dedisperse, {}),
+                           (fdmt_dedisperse, {})):
+        tdm = engine(dsp, dm_grid, **kwargs)
+        tdm_ = engine(dsp_zeroed, dm_grid, **kwargs) * scale
+        assert np.allclose(tdm, tdm_, atol=1e-4)
+    tdm = noncoherent_dedisperse(dsp, dm_grid, decimate=True)
+    tdm_ = noncoherent_dedisperse(dsp_zeroed, dm_grid, decimate=True)
+    assert np.allclose(np.asarray(tdm), np.asarray(tdm_) * scale, atol=1e-4)
+
+    # Non-trivial weights of channels are applied while summing channels
+    dsp = create_dsp(n_t=1000)
+    dsp.weights = np.random.RandomState(1).uniform(0.5, 1.5, size=dsp.n_nu)
+    dsp.mask_channels(slice(0, 4))
+    dsp_weighted = create_dsp(n_t=1000)
+    dsp_weighted.values *= dsp.weights[:, np.newaxis]
+    scale = float(dsp.n_nu) / dsp.n_nu_eff
+    for engine in (noncoherent_dedisperse, tree_dedisperse, fdmt_dedisperse):
+        assert np.allclose(engine(dsp, dm_grid),
+                           engine(dsp_weighted, dm_grid) * scale, atol=1e-4)
+    plan = get_plan(dsp.nu, dsp.d_t.sec, dm_grid)
+    assert np.allclose(plan.dedisperse(dsp.values, wrap=False,
+                                       weights=dsp.weights),
+                       plan.dedisperse(dsp_weighted.values, wrap=False),
+                       atol=1e-4)
+    results = stream_dedisperse([dsp.view(0, 500), dsp.view(500, 1000)],
+                                dm_grid)
+    assert np.allclose(np.hstack([tdm for t_0, tdm in results]),
+                       plan.dedisperse(dsp_weighted.values, wrap=False) /
+                       dsp.n_nu_eff, atol=1e-4)
+
+
+def test_de_disperse_cumsum():
+    # Time shifts between neighbouring channels jump by several time steps
+    dsp = create_dsp(n_nu=32, nu_0=340., d_nu=0.25,
+                     pulses=((0.3, 3., 0.003, 150.),))
+    dsp.mask_channels([3, 4])
+    dm_grid = np.arange(0., 300., 30.)
+    plan = get_plan(dsp.nu, dsp.d_t.sec, dm_grid)
+    assert np.max(abs(np.diff(plan.shifts[-1]))) > 2
+    tdm = dsp.de_disperse_cumsum(dm_grid) / dsp.n_nu_eff
+    assert np.allclose(tdm, noncoherent_dedisperse(dsp, dm_grid), atol=1e-4)
+
+
+def test_batch_dedisperse():
+    dsps = [create_dsp(n_t=1000), create_dsp(n_t=1000, pulses=())]
+    dsps[1].mask_channels(slice(0, 4))
+    dm_grid = np.arange(0., 1000., 50.)
+    tdm = batch_dedisperse(dsps, dm_grid)
+    assert tdm.shape == (2, len(dm_grid), 1000)
+    for i, dsp in enumerate(dsps):
+        assert np.allclose(tdm[i], noncoherent_dedisperse(dsp, dm_grid))
+
+
+def test_out_of_core_dedisperse(tmpdir):
+    import h5py
+    dsp = create_dsp()
+    dsp.mask_channels([0, 1])
+    dm_grid = np.arange(0., 1000., 50.)
+    tdm = noncoherent_dedisperse(dsp, dm_grid)
+    memmap = np.memmap(str(tmpdir.join('tdm.dat')), dtype=float, mode='w+',
+                       shape=tdm.shape)
+    noncoherent_dedisperse(dsp, dm_grid, out=memmap)
+    assert np.allclose(memmap, tdm)
+    for kwargs in ({'threads': 2}, {'n_subbands': 8}, {'decimate': True}):
+        with pytest.raises(ValueError):
+            noncoherent_dedisperse(dsp, dm_grid, out=memmap, **kwargs)
+    with h5py.File(str(tmpdir.join('tdm.hdf5')), 'w') as f:
+        dset = f.create_dataset('tdm', shape=(1, dsp.n_t), maxshape=(None,
+                                                                     None))
+        get_plan(dsp.nu, dsp.d_t.sec, dm_grid).dedisperse_to(
+            dsp.values, dset, weights=dsp.weights,
+            scale=1. / dsp.n_nu_eff, n_dm_block=3)
+        assert np.allclose(dset[...], tdm, atol=1e-5)
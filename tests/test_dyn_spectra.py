@@ -0,0 +1,212 @@
+import pytest
+import numpy as np
+from astropy.time import TimeDelta
+from frb.dyn_spectra import DynSpectra
+from frb.search import dm_from_index
+
+
+meta_data = {'antenna': 'WB', 'freq': 'L', 'band': 'U', 'pol': 'R',
+             'exp_code': 'raks00'}
+
+
+def test_create_dm_grid():
+    dsp = DynSpectra(128, 100, 340., 16./128, 0.001, meta_data=meta_data)
+    dm_grid = dsp.create_dm_grid(0., 1000.)
+    assert dm_grid[0] == 0.
+    assert dm_grid[-1] < 1000.
+    steps = np.diff(dm_grid)
+    assert np.all(steps > 0)
+    assert steps[-1] > 10. * steps[0]
+    # Wider pulses tolerate coarser grid
+    assert len(dsp.create_dm_grid(0., 1000., pulse_width=0.005)) < \
+        len(dm_grid)
+    assert np.allclose(dsp.create_dm_grid(0., 1000., dm_delta=30.),
+                       np.arange(0., 1000., 30.))
+    # Row index to DM
+    assert np.isclose(dm_from_index(2.5, dm_grid),
+                      0.5 * (dm_grid[2] + dm_grid[3]))
+    assert dm_from_index(3, 30.) == 90.
+    for tolerance in (1., 0.5):
+        with pytest.raises(ValueError):
+            dsp.create_dm_grid(0., 1000., tolerance=tolerance)
+
+
+def test_time_axis():
+    from astropy.time import Time
+    t_0 = Time('2016-01-01')
+    dsp = DynSpectra(4, 1000, 1684., 0.25, 0.001, meta_data=meta_data,
+                     t_0=t_0)
+    assert np.allclose(dsp.time_offsets([0, 10, 999]), [0., 0.01, 0.999])
+    assert abs((dsp.times(500) - t_0).sec - 0.5) < 1e-9
+    assert abs((dsp.t_end - t_0).sec - 0.999) < 1e-9
+    assert len(dsp.t) == 1000
+    dsp.append(np.ones((4, 100)))
+    assert abs((dsp.t_end - t_0).sec - 1.099) < 1e-9
+    # Weights of samples grow with values without reallocation
+    mask = np.zeros(dsp.values.shape, dtype=bool)
+    mask[1, :10] = True
+    dsp.mask_samples(mask)
+    dsp.append(np.ones((4, 10)))
+    weights_buffer = dsp._weights_buffer
+    for i in range(10):
+        dsp.append(np.ones((4, 10)))
+    assert dsp._weights_buffer is weights_buffer
+    assert dsp.sample_weights.shape == dsp.values.shape == (4, 1210)
+    assert np.all(dsp.sample_weights[1, :10] == 0.)
+    assert np.all(dsp.sample_weights[:, 10:] == 1.)
+
+
+def test_storage_backends(tmpdir):
+    from frb.dyn_spectra import create_from_hdf5
+    np.random.seed(42)
+    dsp = DynSpectra(32, 500, 1684., 0.5, 0.001, meta_data=meta_data)
+    dsp.add_noise(0.1)
+    dsp.add_pulse(0.2, 3., 0.002, 200.)
+    dm_grid = np.arange(0., 500., 50.)
+    tdm = dsp.grid_dedisperse(dm_grid)
+    for compression, backend in ((None, 'memmap'), ('gzip', 'hdf5')):
+        fname = str(tmpdir.join('dsp_{}.hdf5'.format(backend)))
+        dsp.save_to_hdf5(fname, compression=compression)
+        dsp_ = create_from_hdf5(fname, backend='hdf5')
+        assert dsp_.backend == backend
+        assert np.allclose(dsp_.grid_dedisperse(dm_grid), tdm, atol=1e-5)
+        assert np.allclose(dsp_._de_disperse_by_value(200.),
+                           dsp._de_disperse_by_value(200.))
+        assert np.allclose(dsp_._de_disperse_by_value_freq_average(200.),
+                           tdm[4], atol=1e-5)
+        assert np.allclose(dsp_.slice(0.2, 0.4).values,
+                           dsp.values[:, 100: 200])
+        # Lazily loaded values are read-only
+        with pytest.raises(ValueError):
+            dsp_.add_pulse(0.3, 3., 0.002, 200.)
+        with pytest.raises(ValueError):
+            dsp_.add_noise(0.1)
+        dsp_ = create_from_hdf5(fname, n_nu_discard=4, backend='hdf5')
+        assert dsp_.backend == ('memmap' if backend == 'memmap' else 'numpy')
+        assert np.allclose(dsp_.values[:], dsp.values[2: -2])
+        assert np.allclose(dsp_.nu, dsp.nu[2: -2])
+        dsp_ = create_from_hdf5(fname, n_nu_discard=4, backend='numpy')
+        assert np.allclose(dsp_.values, dsp.values[2: -2])
+        # Values loaded with default backend are writable, file is intact
+        dsp_ = create_from_hdf5(fname)
+        assert dsp_.backend == ('memmap' if backend == 'memmap' else 'numpy')
+        dsp_.add_pulse(0.3, 3., 0.002, 200.)
+        dsp_.add_noise(0.1)
+        assert not np.allclose(dsp_.values, dsp.values)
+        assert np.allclose(create_from_hdf5(fname).values, dsp.values)
+    dsp_ = DynSpectra(32, 500, 1684., 0.5, 0.001, meta_data=meta_data,
+                      backend='numpy')
+    dsp_.add_values(dsp.values)
+    dsp_.append(dsp.values[:, :10])
+    assert dsp_.values.shape == (32, 510)
+    # Plain numpy array is not in shared memory, views of shared one are
+    dsp_ = DynSpectra(32, 500, 1684., 0.5, 0.001, meta_data=meta_data,
+                      values=np.zeros((32, 500), dtype=np.float32))
+    assert dsp_.backend == 'numpy'
+    assert dsp.backend == 'shared'
+    assert dsp.view(100, 200).backend == 'shared'
+
+
+def test_view():
+    from astropy.time import Time
+    t_0 = Time('2016-01-01')
+    dsp = DynSpectra(4, 1000, 1684., 0.25, 0.001, meta_data=meta_data,
+                     t_0=t_0)
+    dsp.values[:] = np.arange(1000)
+    view = dsp.view(100, 300)
+    assert view.n_t == 200
+    assert np.shares_memory(view.values, dsp.values)
+    assert abs((view.t_0 - t_0).sec - 0.1) < 1e-9
+    view.values[0, 0] = -1.
+    assert dsp.values[0, 100] == -1.
+    view = dsp.time_view(0.25, t_0 + TimeDelta(0.5, format='sec'))
+    assert view.n_t == 250
+    assert view.values[1, 0] == 250.
+    assert np.allclose(dsp.slice(0.5, 1.).t_0.jd, dsp.times(500).jd)
+
+
+def test_downsample():
+    dsp = DynSpectra(8, 1001, 1684., 0.25, 0.001, meta_data=meta_data)
+    dsp.values[:] = np.random.RandomState(123).normal(size=dsp.values.shape)
+    frame = dsp.downsample(4, 2)
+    assert frame.values.shape == (4, 250)
+    assert np.isclose(frame.d_t.sec, 0.004)
+    assert np.allclose(frame.nu, dsp.nu.reshape((4, 2)).mean(axis=1))
+    assert np.isclose((frame.t_0 - dsp.t_0).sec, 0.0015)
+    assert np.allclose(frame.values[1, 2],
+                       dsp.values[2: 4, 8: 12].mean(), atol=1e-6)
+    # Masked channels are excluded from averages
+    dsp.mask_channels(0)
+    frame = dsp.downsample(nu_factor=2)
+    assert np.allclose(frame.weights, [0.5, 1., 1., 1.])
+    assert np.allclose(frame.values[0], dsp.values[1], atol=1e-6)
+    # Masked samples as well
+    mask = np.zeros(dsp.values.shape, dtype=bool)
+    mask[3, :500] = True
+    dsp.mask_samples(mask)
+    frame = dsp.downsample(nu_factor=2)
+    assert np.allclose(frame.values[1, :500], dsp.values[2, :500], atol=1e-6)
+    assert np.allclose(frame.sample_weights[1, :2], [0.5, 0.5])
+
+
+def test_cube():
+    from frb.dyn_spectra import DynSpectraCube
+    meta_data_ = dict(meta_data, pol='LR', band='UL')
+    dsp = DynSpectraCube(2, 2, 16, 500, 1684., 0.5, 0.001,
+                         meta_data=meta_data_)
+    dsp.cube[:] = np.random.RandomState(123).normal(size=dsp.cube.shape)
+    dsp.add_pulse(0.2, 3., 0.002, 200.)
+    stokes_i = dsp.cube.reshape((2, 32, 500)).mean(axis=0)
+    assert np.allclose(dsp.values[:, 10: 20], stokes_i[:, 10: 20])
+    # Views share the cube
+    dsp_r = dsp.pol(1)
+    assert dsp_r.meta_data['pol'] == 'R'
+    assert np.shares_memory(dsp_r.values, dsp.cube)
+    assert np.allclose(dsp_r.nu, dsp.nu)
+    upper = dsp.band(1)
+    assert upper.meta_data['band'] == 'U'
+    assert dsp.meta_data['band'] == 'UL'
+    assert np.allclose(upper.nu, dsp.nu[16:])
+    assert np.allclose(np.asarray(upper.values), stokes_i[16:])
+    lower = dsp.band(0, pol=0)
+    assert lower.meta_data['band'] == 'L'
+    assert lower.meta_data['pol'] == 'L'
+    assert np.allclose(lower.values, dsp.cube[0, 0])
+    frame = dsp.view(100, 300)
+    assert np.shares_memory(frame.cube, dsp.cube)
+    assert np.allclose(np.asarray(frame.values), stokes_i[:, 100: 300])
+    # De-dispersion of lazy Stokes I
+    dm_grid = np.arange(0., 500., 50.)
+    dsp_ = DynSpectra(32, 500, 1684., 0.5, 0.001, meta_data=meta_data)
+    dsp_.add_values(stokes_i)
+    assert np.allclose(dsp.grid_dedisperse(dm_grid),
+                       dsp_.grid_dedisperse(dm_grid), atol=1e-5)
+    # Noise of polarizations is independent & averages down in Stokes I
+    np.random.seed(123)
+    dsp = DynSpectraCube(2, 2, 16, 500, 1684., 0.5, 0.001,
+                         meta_data=meta_data_)
+    dsp.add_noise(1.)
+    pol_std = np.std(dsp.cube[0])
+    assert not np.allclose(dsp.cube[0], dsp.cube[1])
+    assert np.isclose(np.std(np.asarray(dsp.values)),
+                      pol_std / np.sqrt(2.), rtol=0.05)
+
+
+def test_add_pulses():
+    from frb.dedispersion import DedispersionPlan
+    dsp = DynSpectra(16, 1000, 1684., 0.5, 0.001, meta_data=meta_data)
+    table = [(0.1, 1., 0.002, 100.), (0.5, 2., 0.001, 300.),
+             (0.502, 1., 0.003, 300.), (0.998, 1., 0.002, 0.)]
+    dsp.add_pulses(table)
+    expected = np.zeros(dsp.values.shape)
+    for t_0, amp, width, dm in table:
+        plan = DedispersionPlan(dsp.nu, 0.001, [dm])
+        expected += amp * np.exp(-0.5 * (dsp.time_offsets() - t_0 -
+                                         plan.delays[0][:, np.newaxis]) ** 2 /
+                                 width ** 2.)
+    assert np.allclose(dsp.values, expected, atol=1e-6)
+    dsp.rm_pulses(table)
+    assert np.allclose(dsp.values, 0., atol=1e-6)
+    dsp.rm_pulses([])
+    dsp.add_pulses([])
+    assert np.allclose(dsp.values, 0., atol=1e-6)
@@ -0,0 +1,105 @@
+import numpy as np
+from frb.raw_data import decode_mark5b, mark5b_levels_2bit
+
+
+def test_decode_mark5b():
+    # Samples 0, 1, 2, 3 of channels 0, 1, 2, 3 & then reversed
+    payload = np.array([0b11100100, 0b00011011], dtype=np.uint8)
+    voltages = decode_mark5b(payload, 4)
+    assert voltages.shape == (2, 4)
+    assert np.all(voltages[0] == mark5b_levels_2bit)
+    assert np.all(voltages[1] == mark5b_levels_2bit[::-1])
+    voltages = decode_mark5b(payload, 8)
+    assert voltages.shape == (1, 8)
+
+
+def test_dspec_cube(tmpdir):
+    from frb.raw_data import read_dspec_cube, dspec_cat
+    from frb.dyn_spectra import DynSpectraCube
+    cfx_fmt = ['4828.00-L-U', '4828.00-R-U', '4828.00-L-L', '4828.00-R-L']
+    data = np.random.RandomState(123).normal(size=(4, 50, 8))
+    for i, values in enumerate(data):
+        np.savetxt(str(tmpdir.join('ds_0{}'.format(i + 1))), values)
+    cube = read_dspec_cube('ds', cfx_fmt, dspec_path=str(tmpdir))
+    assert cube.shape == (2, 2, 8, 50)
+    # Lower band is the first one & its channels are flipped
+    assert np.allclose(cube[1, 0], data[3][:, ::-1].T)
+    assert np.allclose(cube[0, 1], data[0].T)
+    arr = dspec_cat('ds', cfx_fmt, dspec_path=str(tmpdir))
+    assert arr.shape == (50, 16)
+    assert np.allclose(arr[:, 8:], (data[0] + data[1]) / 2.)
+    dsp = DynSpectraCube(2, 2, 8, 50, 4836., 1., 0.001,
+                         meta_data={'antenna': 'WB', 'freq': 'C',
+                                    'band': 'UL', 'pol': 'LR',
+                                    'exp_code': 'raks00'}, cube=cube)
+    assert np.allclose(np.asarray(dsp.values), arr.T)
+
+
+def test_dspec_cube_binary(tmpdir):
+    from frb.raw_data import read_dspec_cube, read_dspec_file
+    cfx_fmt = ['4828.00-L-U', '4828.00-R-U', '4828.00-L-L', '4828.00-R-L']
+    data = np.random.RandomState(123).normal(size=(4, 50, 8))
+    data = data.astype(np.float32)
+    for i, values in enumerate(data):
+        values.tofile(str(tmpdir.join('ds_0{}'.format(i + 1))))
+    assert np.all(read_dspec_file(str(tmpdir.join('ds_01')), 8) == data[0])
+    cube = read_dspec_cube('ds', cfx_fmt, dspec_path=str(tmpdir), n_nu=8)
+    assert cube.shape == (2, 2, 8, 50)
+    assert np.all(cube[1, 0] == data[3][:, ::-1].T)
+    assert np.all(cube[0, 1] == data[0].T)
+
+
+def test_coherent_profile(tmpdir):
+    import os
+    from collections import namedtuple
+    from astropy.time import Time, TimeDelta
+    from frb.raw_data import (M5, mark5b_frame_size, mark5b_header_size,
+                              mark5b_payload_size, mark5b_sync_word)
+    from frb.dedispersion import coherent_dedisperse, k
+    rnd = np.random.RandomState(1)
+    cfx_fmt = ['4828.00-L-U', '4828.00-R-U', '4828.00-L-L', '4828.00-R-L']
+    sample_rate = 32e6
+    dm = 500.
+    n_frames = 48
+    n_samples = n_frames * mark5b_payload_size
+    # Pulse arrives at the highest frequency of band 8 ms after start
+    t_pulse = 0.008
+    voltages = rnd.normal(size=(n_samples, 4))
+    for i, fmt in enumerate(cfx_fmt):
+        nu_ref, _, sb = fmt.split('-')
+        nu_ref = float(nu_ref)
+        start = int(round((t_pulse + k * dm * (1. / nu_ref ** 2. -
+                                                1. / 4844. ** 2.)) *
+                          sample_rate))
+        voltages[start: start + 1000, i] *= 4.
+        voltages[:, i] = coherent_dedisperse(voltages[:, i], nu_ref, 16., -dm,
+                                             sideband=sb)
+    # Quantize to 2 bits (indexes of ``mark5b_levels_2bit``) & pack samples
+    # of 4 channels in bytes
+    voltages /= voltages.std(axis=0)
+    indexes = np.where(voltages > 0, np.where(voltages > 0.98, 3, 1),
+                       np.where(voltages < -0.98, 0, 2))
+    payload = (indexes << (2 * np.arange(4))).sum(axis=1).astype(np.uint8)
+    frames = np.zeros((n_frames, mark5b_frame_size), dtype=np.uint8)
+    frames[:, :4] = np.frombuffer(mark5b_sync_word, dtype=np.uint8)
+    frames[:, mark5b_header_size:] = payload.reshape((n_frames, -1))
+    fname = str(tmpdir.join('pulse.m5b'))
+    frames.tofile(fname)
+    m5 = M5.__new__(M5)
+    m5.m5file = fname
+    m5.fmt = 'Mark5B-256-4-2'
+    m5.size = os.path.getsize(fname)
+    m5.starttime = Time('2016-01-01')
+
+    Candidate = namedtuple('Candidate', ['t', 'dm'])
+    t = (m5.starttime + TimeDelta(t_pulse, format='sec')).utc.datetime
+    profile = m5.coherent_profile(Candidate(t, dm), cfx_fmt, duration=0.004,
+                                  d_t=1e-4)
+    assert profile.shape == (40,)
+    # Profile starts 2 ms before pulse, pulse lasts ~31 us
+    assert np.argmax(profile) == 20
+    assert profile[20] > np.median(profile) + 10. * np.std(profile[:15])
+    # Without de-dispersion pulse is smeared over ~0.6 ms
+    profile_0 = m5.coherent_profile(Candidate(t, 0.), cfx_fmt,
+                                    duration=0.004, d_t=1e-4)
+    assert profile_0.max() < 0.5 * profile.max()
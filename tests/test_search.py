@@ -0,0 +1,202 @@
+import pytest
+import numpy as np
+from astropy.time import Time
+from frb.search import boxcar_snr, search_candidates_boxcar
+
+
+def test_boxcar_snr():
+    np.random.seed(123)
+    row = np.random.normal(size=1000)
+    row[500:520] += 2.
+    snr, widths = boxcar_snr(row, widths=(1, 4, 16, 64))
+    assert snr.shape == row.shape
+    assert 500 <= np.argmax(snr) < 520
+    assert widths[np.argmax(snr)] == 16
+    assert snr.max() > 6.
+
+
+def test_search_candidates_boxcar():
+    np.random.seed(123)
+    image = np.random.normal(size=(20, 3000))
+    # Two pulses with different widths
+    image[5, 1000:1004] += 5.
+    image[12, 2000:2030] += 2.
+    t_0 = Time.now()
+    candidates = search_candidates_boxcar(image, t_0, 0.001, 30., n_sigma=7.)
+    assert len(candidates) == 2
+    candidates = sorted(candidates, key=lambda c: c.t)
+    assert candidates[0].dm == 150.
+    assert candidates[1].dm == 360.
+    assert candidates[0].width < candidates[1].width
+    assert np.isclose(candidates[1].width, 0.032)
+    assert all(c.snr > 7. for c in candidates)
+
+
+def test_searcher_out_of_core(tmpdir, monkeypatch):
+    import h5py
+    import frb.search_candidates
+    from frb.dyn_spectra import DynSpectra
+    from frb.dedispersion import noncoherent_dedisperse
+    from frb.search_candidates import Searcher
+    np.random.seed(123)
+    meta_data = {'antenna': 'WB', 'freq': 'L', 'band': 'U', 'pol': 'R',
+                 'exp_code': 'raks00'}
+    dsp = DynSpectra(64, 3000, 1684., 0.25, 0.001, meta_data=meta_data,
+                     t_0=Time('2016-01-01'))
+    dsp.values += np.random.normal(size=dsp.values.shape)
+    dsp.add_pulse(1., 3., 0.003, 300.)
+    dm_grid = np.arange(0., 1000., 30.)
+    searcher = Searcher(dsp, cache_dir=str(tmpdir), out_of_core=True)
+    candidates = searcher.run(noncoherent_dedisperse,
+                              search_candidates_boxcar,
+                              de_disp_args=[dm_grid],
+                              search_kwargs={'d_dm': dm_grid, 'n_sigma': 7.})
+    assert isinstance(searcher._de_dispersed_data, h5py.Dataset)
+    assert len(candidates) == 1
+    assert abs(candidates[0].dm - 300.) <= 100.
+
+    # Search function gets out-of-core data without loading it to memory
+    images = list()
+
+    def search_func(image, **kwargs):
+        images.append(image)
+        return search_candidates_boxcar(image, **kwargs)
+
+    candidates_ = searcher.search(search_func, d_dm=dm_grid, n_sigma=7.)
+    assert not isinstance(images[0], np.ndarray)
+    assert images[0].shape == searcher._de_dispersed_data.shape
+    assert [c.t for c in candidates_] == [c.t for c in candidates]
+
+    # Pre-processing works on blocks of rows and writes result to cache
+    blocks = list()
+
+    def preprocess_func(image, scale):
+        blocks.append(image.shape)
+        image *= scale
+        return image
+
+    # Few rows per block
+    monkeypatch.setattr(frb.search_candidates, '_pre_process_block_size',
+                        10 * dsp.n_t)
+    n_t = searcher._de_dispersed_data.shape[1]
+    searcher.pre_process(preprocess_func, 2.)
+    assert isinstance(searcher._pre_processed_data, h5py.Dataset)
+    assert len(blocks) == 4
+    assert sum(shape[0] for shape in blocks) == len(dm_grid)
+    assert all(shape[1] == n_t for shape in blocks)
+    assert np.allclose(searcher._pre_processed_data[...],
+                       2. * searcher._de_dispersed_data[...])
+
+    # Failed de-dispersion doesn't leave empty data in cache
+    def failing_dedisperse(dsp, dm_grid, out=None):
+        out[0] = 1.
+        raise ValueError
+
+    searcher = Searcher(dsp, cache_dir=str(tmpdir), out_of_core=True)
+    keys = set(searcher._de_dispersed_cache.keys())
+    with pytest.raises(ValueError):
+        searcher.de_disperse(failing_dedisperse, dm_grid)
+    assert set(searcher._de_dispersed_cache.keys()) == keys
+
+
+def test_searcher_chunks(tmpdir):
+    from frb.dyn_spectra import DynSpectra
+    from frb.dedispersion import noncoherent_dedisperse
+    from frb.search_candidates import Searcher
+    np.random.seed(123)
+    meta_data = {'antenna': 'WB', 'freq': 'L', 'band': 'U', 'pol': 'R',
+                 'exp_code': 'raks00'}
+    dsp = DynSpectra(64, 6000, 1684., 0.25, 0.001, meta_data=meta_data,
+                     t_0=Time('2016-01-01'))
+    dsp.values += np.random.normal(size=dsp.values.shape)
+    # Pulse crosses boundary of the first two chunks
+    dsp.add_pulse(1.995, 3., 0.003, 300.)
+    dm_grid = np.arange(0., 600., 30.)
+    n_delay = int(np.ceil(dsp.max_delay(600.) / 0.001))
+    chunks = list(dsp.iter_chunks(2., dm_max=600.))
+    assert [chunk.n_t for chunk in chunks] == [2000 + n_delay,
+                                               2000 + n_delay, 2000]
+    assert np.shares_memory(chunks[1].values, dsp.values)
+    assert abs((chunks[1].t_0 - dsp.t_0).sec - 2.) < 1e-9
+    searcher = Searcher(dsp, cache_dir=str(tmpdir))
+    candidates = list(searcher.run_chunks(2., noncoherent_dedisperse,
+                                          search_candidates_boxcar,
+                                          dm_max=600.,
+                                          de_disp_args=[dm_grid],
+                                          search_kwargs={'d_dm': dm_grid,
+                                                         'n_sigma': 7.}))
+    assert [len(candidates_) for candidates_ in candidates] == [1, 0, 0]
+
+
+def test_upgrade_db(tmpdir):
+    import sqlite3
+    from frb.candidates import Candidate, SearchedData
+    from frb.queries import connect_to_db
+    db_file = str(tmpdir.join('old.db'))
+    # Candidates table of DB created before ``width`` and ``snr`` columns
+    connection = sqlite3.connect(db_file)
+    connection.execute("CREATE TABLE candidates (id INTEGER PRIMARY KEY,"
+                       " t DATETIME, dm FLOAT, searched_data_id INTEGER)")
+    connection.execute("INSERT INTO candidates (t, dm) VALUES"
+                       " ('2016-01-01 00:00:00.000000', 100.)")
+    connection.commit()
+    connection.close()
+    session = connect_to_db(db_file)
+    searched_data = SearchedData(algo='test', antenna='WB', freq='L',
+                                 band='U', pol='R', exp_code='raks00',
+                                 t_0=Time('2016-01-01').utc.datetime,
+                                 t_end=Time('2016-01-02').utc.datetime)
+    searched_data.candidates = [Candidate(Time('2016-01-01T00:00:01'), 300.,
+                                          width=0.002, snr=10.)]
+    session.add(searched_data)
+    session.commit()
+    candidates = session.query(Candidate).order_by(Candidate.id).all()
+    assert candidates[0].snr is None
+    assert candidates[1].snr == 10.
+
+
+def test_candidate_repr():
+    from frb.candidates import Candidate
+    t = Time('2016-01-01T00:00:01')
+    assert repr(Candidate(t, 300.)) ==\
+        "FRB candidate. t0: 2016-01-01 00:00:01.000 DM: 300"
+    assert repr(Candidate(t, 300., width=0.002, snr=10.)).endswith(
+        " DM: 300 width: 0.0020, SNR: 10.0")
+    assert repr(Candidate(t, 300., snr=10.)).endswith(" DM: 300 SNR: 10.0")
+    assert repr(Candidate(t, 300., width=0.002)).endswith(
+        " DM: 300 width: 0.0020")
+
+
+def test_search_decimated(tmpdir, monkeypatch):
+    import h5py
+    from frb.dyn_spectra import DynSpectra
+    from frb.dedispersion import noncoherent_dedisperse, MultiResolutionTDM
+    from frb.search_candidates import Searcher
+    np.random.seed(123)
+    meta_data = {'antenna': 'WB', 'freq': 'P', 'band': 'U', 'pol': 'R',
+                 'exp_code': 'raks00'}
+    dsp = DynSpectra(64, 4000, 340., 0.25, 0.001, meta_data=meta_data,
+                     t_0=Time('2016-01-01'))
+    dsp.values += np.random.normal(size=dsp.values.shape)
+    dsp.add_pulse(1., 0.3, 0.01, 500.)
+    dm_grid = np.arange(0., 1000., 25.)
+    searcher = Searcher(dsp, cache_dir=str(tmpdir))
+    searcher.de_disperse(noncoherent_dedisperse, dm_grid, decimate=True)
+    searcher.pre_process(None)
+    # Neither search nor cache expands image to the full time resolution
+    monkeypatch.setattr(MultiResolutionTDM, 'expand', None)
+    candidates = searcher.search(search_candidates_boxcar, d_dm=dm_grid,
+                                 n_sigma=7.)
+    assert len(candidates) == 1
+    assert candidates[0].dm == 500.
+    assert abs((candidates[0].t - dsp.t_0.utc.datetime).total_seconds() -
+               1.) < 0.02
+    group = searcher._de_dispersed_cache.values()[0]
+    assert isinstance(group, h5py.Group)
+
+    # Cached image is loaded in its own resolution
+    searcher = Searcher(dsp, cache_dir=str(tmpdir))
+    searcher.de_disperse(noncoherent_dedisperse, dm_grid, decimate=True)
+    tdm = searcher._de_dispersed_data
+    assert isinstance(tdm, MultiResolutionTDM)
+    assert tdm.nbytes < 4000 * len(dm_grid) * 8